@@ -0,0 +1,98 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares how long L{buzz.Result} takes to turn decoded pages of posts into
+L{buzz.Post} objects using L{buzz.RESULT_DECODERS}, against the per-type
+if/elif dispatch and parse helpers it used to have.  Both build the same,
+current L{buzz.Post} objects, so this measures the dispatch and construction
+of each item, not the models as they used to be.  Every post's id is read,
+as when scanning a feed for new posts.
+
+Usage: python benchmarks/decode_pages.py [recorded response.json ...]
+
+Without arguments, synthetic pages are used.  Recorded responses should be
+the JSON bodies of activity feeds, e.g. saved from the API with curl.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import buzz
+import model_memory
+
+def dispatch_decode(result, json):
+  # The dispatch used before decoders were registered by result type
+  if result.result_type == buzz.Post and result.singular:
+    return dispatch_parse_post(result, json)
+  elif result.result_type == buzz.Post and not result.singular:
+    return dispatch_parse_posts(result, json)
+  raise TypeError('Only posts are benchmarked')
+
+def dispatch_parse_post(result, json):
+  try:
+    if json.get('error'):
+      result._parse_error(json)
+    json = buzz._prune_json_envelope(json)
+    if isinstance(json, list) and len(json) == 1:
+      json = json[0]
+    return buzz.Post(json, client=result.client)
+  except KeyError, e:
+    raise buzz.JSONParseError(uri=result._http_uri, json=json, exception=e)
+
+def dispatch_parse_posts(result, json):
+  try:
+    if json.get('error'):
+      result._parse_error(json)
+    json = buzz._prune_json_envelope(json)
+    if isinstance(json, list):
+      return [
+        buzz.Post(post_json, client=result.client) for post_json in json
+      ]
+    else:
+      return []
+  except KeyError, e:
+    raise buzz.JSONParseError(uri=result._http_uri, json=json, exception=e)
+
+def load_pages(paths):
+  if paths:
+    return [buzz.JSON_BACKEND.decode(open(path).read()) for path in paths]
+  return [
+    {'data': {'items': [
+      model_memory.post_json(page * 100 + i) for i in range(100)
+    ]}}
+    for page in range(10)
+  ]
+
+def run(decode, result, pages):
+  for page in pages:
+    for post in decode(result, page):
+      post.id
+
+if __name__ == '__main__':
+  pages = load_pages(sys.argv[1:])
+  items = sum([len(buzz._prune_json_envelope(page)) for page in pages])
+  result = buzz.Result(buzz.Client(), 'GET', buzz.API_PREFIX)
+  for name, decode in [
+      ('per-item dispatch', dispatch_decode),
+      ('decoder registry', buzz.Result._decode_page)]:
+    best = min(timeit.repeat(
+      lambda: run(decode, result, pages), number=10, repeat=5
+    )) / 10
+    print '%-18s %8.2f ms per run, %6.2f us per post' % (
+      name, best * 1000, best * 1000000 / items
+    )
+  print '(per-item dispatch vs registry, same models)'
@@ -0,0 +1,113 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how many bytes each parsed L{buzz.Post} keeps alive, with and
+without the JSON it was decoded from.  Sizes are the sum of sys.getsizeof
+over every object reachable from the posts, each counted once.
+
+Usage: python benchmarks/model_memory.py [number of posts]
+"""
+
+import os
+import sys
+import types
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import buzz
+
+def post_json(i):
+  return {
+    'id': 'tag:google.com,2010:buzz:z12post%d' % i,
+    'title': 'Post number %d' % i,
+    'published': '2010-06-01T12:00:00.000Z',
+    'updated': '2010-06-01T12:30:00.000Z',
+    'verb': ['post'],
+    'object': {
+      'type': 'note',
+      'content': 'Some content for post %d. ' % i * 4,
+      'attachments': [{
+        'type': 'article',
+        'title': 'A link',
+        'links': {'alternate': [{'href': 'http://example.com/%d' % i}]}
+      }]
+    },
+    'actor': {
+      'id': '1234567890%d' % (i % 50),
+      'name': 'Author %d' % (i % 50),
+      'profileUrl': 'http://www.google.com/profiles/author%d' % (i % 50),
+      'thumbnailUrl': 'http://www.google.com/s2/photos/public/%d' % (i % 50)
+    },
+    'links': {
+      'alternate': [{
+        'href': 'http://www.google.com/buzz/post/%d' % i, 'type': 'text/html'
+      }],
+      'replies': [{'href': 'http://example.com/replies/%d' % i, 'count': 2}],
+      'liked': [{'href': 'http://example.com/liked/%d' % i, 'count': 5}]
+    },
+    'visibility': {'entries': [{
+      'id': 'tag:google.com,2010:buzz-group:@me:@public', 'title': 'Public'
+    }]}
+  }
+
+def deep_size(root, seen):
+  size = 0
+  pending = [root]
+  while pending:
+    obj = pending.pop()
+    if id(obj) in seen or isinstance(obj, (type, types.ModuleType)) or \
+        isinstance(obj, buzz.Client):
+      continue
+    seen.add(id(obj))
+    size += sys.getsizeof(obj)
+    if isinstance(obj, dict):
+      pending.extend(obj.keys())
+      pending.extend(obj.values())
+    elif isinstance(obj, (list, tuple)):
+      pending.extend(obj)
+    else:
+      for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+          if hasattr(obj, name):
+            pending.append(getattr(obj, name))
+      if hasattr(obj, '__dict__'):
+        pending.append(obj.__dict__)
+  return size
+
+def measure(count, retain_json):
+  client = buzz.Client()
+  client.retain_json = retain_json
+  posts = [buzz.Post(post_json(i), client=client) for i in range(count)]
+  for post in posts:
+    if retain_json:
+      # Read everything, as an application holding on to the posts would
+      for name in buzz.Post._lazy_attributes:
+        getattr(post, name)
+    else:
+      buzz._release_json(post)
+  return deep_size(posts, set()) / float(count)
+
+if __name__ == '__main__':
+  count = 1000
+  if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+  payload = deep_size([post_json(i) for i in range(count)], set()) / \
+    float(count)
+  retained = measure(count, True)
+  released = measure(count, False)
+  print 'Decoded JSON alone:   %8.0f bytes per post' % payload
+  print 'Posts with JSON:      %8.0f bytes per post' % retained
+  print 'Posts without JSON:   %8.0f bytes per post' % released
+  print 'Post instance itself: %8d bytes' % \
+    sys.getsizeof(buzz.Post(post_json(0)))
@@ -0,0 +1,54 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how many OAuth Authorization headers per second can be built for
+API requests, with the OAuth library as L{buzz.Client.build_oauth_request}
+does, and with the client's L{buzz.OAuthSigner}, given either the URI alone
+or its query parameters as well.
+
+Usage: python benchmarks/oauth_signing.py [number of signatures]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import buzz
+
+URI = buzz.API_PREFIX + \
+  '/activities/search?q=google+buzz&lat=37.42&lon=-122.08&alt=json' + \
+  '&max-results=20'
+
+if __name__ == '__main__':
+  count = 5000
+  if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+  client = buzz.Client()
+  client.build_oauth_consumer('example.com', 'consumer secret')
+  client.build_oauth_access_token('1/access-token', 'token secret')
+  parameters = buzz._query_parameters(URI.split('?', 1)[1])
+  def oauth_library():
+    client.build_oauth_request('GET', URI).to_header()
+  def signer():
+    client.oauth_signer.header('GET', URI)
+  def signer_with_parameters():
+    client.oauth_signer.header('GET', URI, parameters)
+  for name, sign in [
+      ('OAuth library', oauth_library),
+      ('OAuthSigner', signer),
+      ('OAuthSigner, parameters given', signer_with_parameters)]:
+    best = min(timeit.repeat(sign, number=count, repeat=3))
+    print '%-30s %8d signatures per second' % (name, count / best)
@@ -0,0 +1,83 @@
+# Copyright 2010 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Times iterating over a feed of posts page by page, with and without
+prefetching or streaming, against a L{buzz.Cassette} that replays each page
+after a fixed delay.  This stands in for a round trip to the API, so runs
+can be compared without a network connection or credentials.  Each post also
+takes a little time to consume, by default as long in total per page as a
+page takes to arrive, which is the work prefetching overlaps with fetching.
+
+Usage: python benchmarks/replay_iteration.py [latency in ms] [pages]
+  [work per page in ms]
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import buzz
+import model_memory
+
+def build_client(latency, pages):
+  client = buzz.Client()
+  client.build_oauth_consumer('consumer key', 'consumer secret')
+  client.build_oauth_access_token('token key', 'token secret')
+  client.transport = buzz.Cassette(None, latency=latency)
+  uri = client.posts(user_id='1234567890', max_results=100)._request.uri
+  for page in range(pages):
+    feed = {'items': [
+      model_memory.post_json(page * 100 + i) for i in range(100)
+    ]}
+    next_uri = uri.split('&c=')[0] + '&c=page%d' % (page + 1)
+    if page + 1 < pages:
+      feed['links'] = {'next': [{'href': next_uri}]}
+    client.transport.add(
+      'GET', uri, 200, buzz.JSON_BACKEND.encode({'data': feed})
+    )
+    uri = next_uri
+  return client
+
+def run(client, work=0, **options):
+  result = client.posts(user_id='1234567890', max_results=100)
+  count = 0
+  for post in result.iterator(**options):
+    post.id
+    if work:
+      # Stands in for whatever the caller does with each post
+      time.sleep(work)
+    count += 1
+  return count
+
+if __name__ == '__main__':
+  latency = 50
+  pages = 10
+  if len(sys.argv) > 1:
+    latency = float(sys.argv[1])
+  if len(sys.argv) > 2:
+    pages = int(sys.argv[2])
+  work = latency
+  if len(sys.argv) > 3:
+    work = float(sys.argv[3])
+  client = build_client(latency / 1000.0, pages)
+  for name, options in [
+      ('one page at a time', {}),
+      ('prefetch=2', {'prefetch': 2}),
+      ('stream', {'stream': True})]:
+    start = time.time()
+    count = run(client, work / 1000.0 / 100, **options)
+    elapsed = time.time() - start
+    print '%-20s %8.1f ms for %d posts' % (name, elapsed * 1000, count)
@@ -57,10 +57,58 @@ Common Tasks
     results = client.posts(user_id='@me', type_id='@self')
   - Another user's public posts::
     results = client.posts(user_id='googlebuzz', type_id='@public')
+  - Fetching only the fields a job needs, as a partial response::
+    results = client.posts(
+      user_id='googlebuzz', type_id='@public',
+      fields='data(items(id,published,actor/id),links)'
+    )
   - Larger result pages::
     results = client.posts(
       user_id='googlebuzz', type_id='@public', max_results=100
     )
+  - Fetching the next pages in the background while iterating::
+    for post in results.iterator(prefetch=2):
+      print post.id
+  - Handling each post as soon as it arrives on a very large page::
+    for post in results.iterator(stream=True):
+      print post.id
+  - Skipping posts without a geocode before they're decoded::
+    for post in results.iterator(
+        item_filter=lambda post_json: post_json.get('geocode')):
+      print post.geocode
+  - Forwarding the JSON for each post without building L{Post} objects::
+    for post_json in results.iterator(raw=True):
+      print post_json['id']
+  - Making many calls at once without blocking::
+    async_client = buzz.AsyncClient(client)
+    futures = [async_client.person(user_id) for user_id in user_ids]
+    people = [future.result().data for future in futures]
+  - Looking up many people at once, with an error for each failed lookup::
+    futures = client.map_fetch(client.person, user_ids)
+    people = [
+      future.result().data for future in futures if not future.exception()
+    ]
+  - Liking many posts in a single round trip::
+    batch = client.batch(multipart=True)
+    for post_id in post_ids:
+      batch.like_post(post_id)
+    batch.execute()
+  - Staying under quota across many clients and threads::
+    rate_limiter = buzz.RateLimiter(consumer_rate=10, token_rate=1)
+    for client in clients:
+      client.rate_limiter = rate_limiter
+  - Caching profiles in memory for an hour::
+    client.response_cache = buzz.ResponseCache(ttl=0, ttls={'person': 3600})
+  - Keeping many posts in memory without the JSON they came from::
+    client.retain_json = False
+  - Recording API traffic, then replaying it offline with 50ms of latency::
+    client.transport = buzz.Cassette('posts.json', record=True)
+    client.posts().data
+    client.transport.save()
+    client.transport = buzz.Cassette('posts.json', latency=0.05)
+    client.posts().data
+  - Checking which JSON implementation decodes responses::
+    print buzz.JSON_BACKEND.name
 - Creating a post
   - Simple::
     post = buzz.Post(
@@ -94,6 +142,18 @@ import httplib
 import string
 import urllib
 import re
+import threading
+import time
+import copy
+import collections
+import Queue
+import random
+import socket
+import email.utils
+import zlib
+import weakref
+import hmac
+import binascii
 
 import logging
 
@@ -110,6 +170,19 @@ try:
 except (ImportError):
   import simplejson
 
+try:
+  import hashlib
+  _sha1 = hashlib.sha1
+except (ImportError):
+  # Python 2.4
+  import sha as _sha1
+
+try:
+  import json as _stdlib_json
+except (ImportError):
+  # Only Python 2.6 and later have it
+  _stdlib_json = None
+
 default_path = os.path.join(
   os.path.dirname(__file__), 'buzz_python_client.yaml'
 )
@@ -149,6 +222,26 @@ else:
 
 DEFAULT_PAGE_SIZE = 20
 
+# Google's APIs only compress responses for user agents that mention gzip
+USER_AGENT = 'buzz-python-client/0.2.1 (gzip)'
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_IDLE_TIMEOUT = 60
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_POCO_CONCURRENCY = 4
+DEFAULT_ASYNC_WORKERS = 100
+
+# Multipart batches are sent to this path on the API's host
+BATCH_PATH = '/batch'
+MAX_BATCH_PARTS = 100
+
+DEFAULT_MAX_RETRIES = 3
+
+DEFAULT_CACHE_ENTRIES = 1000
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+DEFAULT_CACHE_TTL = 60
+
 class RetrieveError(Exception):
   """
   This exception gets raised if there was some kind of HTTP or network error
@@ -250,32 +343,1531 @@ def _parse_geocode(geocode):
     raise ValueError('Bogus geocode.')
   return (lat, lon)
 
+def _text(value):
+  # Text is sometimes wrapped up as {'value': ...}
+  if isinstance(value, dict):
+    return value.get('value')
+  return value
+
+def _first(value):
+  # Only the first of several values matters
+  if isinstance(value, list):
+    return value[0]
+  return value
+
+def _field_reader(keys, convert=None):
+  """
+  Compiles a field spec into a function which reads the field from the JSON
+  for an item: the first of C{keys} with a value, passed through C{convert},
+  or C{None} if there isn't one.
+  """
+  if isinstance(keys, basestring):
+    keys = (keys,)
+  if len(keys) == 1 and not convert:
+    key = keys[0]
+    def read(json):
+      return json.get(key) or None
+    return read
+  def read(json):
+    for key in keys:
+      value = json.get(key)
+      if value:
+        if convert:
+          return convert(value)
+        return value
+    return None
+  return read
+
+def _compile_fields(*specs):
+  """
+  Compiles the C{(attribute, keys[, convert])} field specs of a model into
+  C{(attribute, reader)} pairs.
+  """
+  return tuple([(spec[0], _field_reader(*spec[1:])) for spec in specs])
+
+def _parse_authority(uri):
+  """Splits a URI into the (scheme, host, port) used to key connections."""
+  parsed = urlparse.urlparse(uri)
+  authority = parsed[1].split(':')
+  if len(authority) == 1:
+    # Incidentally, this is why unpacking shouldn't complain about
+    # size mismatch on the array.  Bad Python.  Stop trying to protect me!
+    host = authority[0]
+    port = None
+  else:
+    host, port = authority
+    port = int(port)
+  if not port:
+    if parsed[0] == 'https':
+      port = 443
+    else:
+      port = 80
+  return (parsed[0], host, port)
+
+class ConnectionPool:
+  """
+  The L{ConnectionPool} object hands out keep-alive HTTP connections to the
+  threads sharing a L{Client}.  Connections are pooled per host and a
+  connection is only ever used by one thread at a time.  Connections which
+  have sat idle for longer than C{idle_timeout} seconds are closed rather than
+  reused, since the server has most likely dropped them already.
+  """
+  def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None,
+      idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """
+    @type max_connections: int
+    @param max_connections: The maximum number of connections per host.
+    @type timeout: float
+    @param timeout: How long to wait for a connection when all of them are
+      checked out.  C{None} waits forever.
+    @type idle_timeout: float
+    @param idle_timeout: How long an idle connection may be kept around.
+    """
+    self.max_connections = max_connections
+    self.timeout = timeout
+    self.idle_timeout = idle_timeout
+    self._condition = threading.Condition()
+    # Idle (connection, last_used) pairs per host, most recently used last
+    self._idle = {}
+    # Number of open connections per host, whether idle or checked out
+    self._counts = {}
+
+  def _connect(self, scheme, host, port):
+    if scheme == 'https':
+      connection = httplib.HTTPSConnection(host, port)
+    else:
+      connection = httplib.HTTPConnection(host, port)
+    connection._pool_key = (scheme, host, port)
+    return connection
+
+  def _evict_idle(self, key):
+    idle = self._idle.get(key)
+    if not idle or self.idle_timeout is None:
+      return
+    cutoff = time.time() - self.idle_timeout
+    while idle and idle[0][1] < cutoff:
+      connection, last_used = idle.pop(0)
+      connection.close()
+      self._counts[key] -= 1
+
+  def checkout(self, scheme, host, port):
+    """
+    Returns a connection to the given host, waiting for one to be checked in
+    if the pool is at its limit.  Every connection checked out must be handed
+    back with either L{checkin} or L{discard}.
+    """
+    key = (scheme, host, port)
+    deadline = None
+    if self.timeout is not None:
+      deadline = time.time() + self.timeout
+    self._condition.acquire()
+    try:
+      while True:
+        self._evict_idle(key)
+        idle = self._idle.get(key)
+        if idle:
+          connection, last_used = idle.pop()
+          return connection
+        if self._counts.get(key, 0) < self.max_connections:
+          self._counts[key] = self._counts.get(key, 0) + 1
+          break
+        if deadline is None:
+          self._condition.wait()
+        else:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            raise RetrieveError(
+              uri='%s://%s:%s' % key,
+              message='Timed out waiting for a pooled connection'
+            )
+          self._condition.wait(remaining)
+    finally:
+      self._condition.release()
+    return self._connect(scheme, host, port)
+
+  def checkin(self, connection):
+    """Returns a healthy connection to the pool so that it can be reused."""
+    key = connection._pool_key
+    self._condition.acquire()
+    try:
+      self._idle.setdefault(key, []).append((connection, time.time()))
+      self._condition.notify()
+    finally:
+      self._condition.release()
+
+  def discard(self, connection):
+    """Closes a connection that is broken or in an unknown state."""
+    key = connection._pool_key
+    connection.close()
+    self._condition.acquire()
+    try:
+      self._counts[key] -= 1
+      self._condition.notify()
+    finally:
+      self._condition.release()
+
+  def close(self):
+    """Closes every idle connection held by the pool."""
+    self._condition.acquire()
+    try:
+      for key, idle in self._idle.items():
+        for connection, last_used in idle:
+          connection.close()
+          self._counts[key] -= 1
+      self._idle = {}
+    finally:
+      self._condition.release()
+
+# Clients share this pool unless they ask for one of their own, so that many
+# per-user clients can ride on the same few keep-alive connections
+SHARED_CONNECTION_POOL = ConnectionPool()
+
+# API_PREFIX rarely changes, so there's no need to parse it for every client
+_api_prefix_authorities = {}
+
+class _PooledResponse:
+  """
+  Wraps an C{httplib.HTTPResponse} so that its connection goes back to the
+  L{ConnectionPool} as soon as the body has been read in full.  A response
+  that is abandoned part way through leaves its connection unusable, so in
+  that case the connection is discarded instead.
+  """
+  def __init__(self, response, pool, connection):
+    self._response = response
+    self._pool = pool
+    self._connection = connection
+
+  def read(self, amt=None):
+    try:
+      data = self._response.read(amt)
+    except:
+      self.release()
+      raise
+    if self._response.isclosed():
+      self.release()
+    return data
+
+  def release(self):
+    connection = self._connection
+    if connection:
+      self._connection = None
+      if self._response.isclosed():
+        self._pool.checkin(connection)
+      else:
+        self._pool.discard(connection)
+
+  def __del__(self):
+    self.release()
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+class _DecompressingResponse:
+  """
+  Wraps a gzip or deflate encoded response so that reads return the decoded
+  body.  The body is decompressed a chunk at a time as it comes off the
+  socket, so a partial read never decompresses more than it has to.
+  """
+  _chunk_size = 16 * 1024
+
+  def __init__(self, response, encoding):
+    self._response = response
+    self._encoding = encoding
+    if encoding == 'gzip':
+      self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+      self._decompressor = zlib.decompressobj()
+    self._buffer = ''
+    self._started = False
+    self._finished = False
+
+  def _decompress(self, data):
+    try:
+      return self._decompressor.decompress(data)
+    except zlib.error:
+      if self._encoding == 'deflate' and not self._started:
+        # Some servers send raw deflate data without the zlib header
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+      raise
+
+  def _fill(self):
+    data = self._response.read(self._chunk_size)
+    if data:
+      decoded = self._decompress(data)
+      self._started = True
+      return decoded
+    self._finished = True
+    return self._decompressor.flush()
+
+  def read(self, amt=None):
+    if amt is None:
+      chunks = [self._buffer]
+      self._buffer = ''
+      while not self._finished:
+        chunks.append(self._fill())
+      return ''.join(chunks)
+    while len(self._buffer) < amt and not self._finished:
+      self._buffer += self._fill()
+    data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+    return data
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+class _BufferedResponse:
+  """
+  A stand-in for an C{httplib.HTTPResponse} whose body is already in memory,
+  such as a response served from the L{ResponseCache}.
+  """
+  def __init__(self, status, reason='', headers=None, body=''):
+    self.status = status
+    self.reason = reason
+    self._headers = {}
+    for name, value in (headers or {}).items():
+      self._headers[name.lower()] = value
+    self._body = body
+
+  def read(self, amt=None):
+    if amt is None:
+      data, self._body = self._body, ''
+    else:
+      data, self._body = self._body[:amt], self._body[amt:]
+    return data
+
+  def getheader(self, name, default=None):
+    return self._headers.get(name.lower(), default)
+
+  def getheaders(self):
+    return self._headers.items()
+
+class JSONBackend:
+  """
+  The L{JSONBackend} object wraps a JSON implementation, such as simplejson
+  or the standard library's json module, for decoding responses and encoding
+  request bodies.  One decoder and one encoder are shared by every request.
+  Decoding isn't strict, so that illegal control characters in responses
+  don't break things.
+  """
+  def __init__(self, name, module):
+    """
+    @type name: string
+    @param name: A description of the implementation, for reporting.
+    @type module: module
+    @param module: A module with simplejson's C{JSONDecoder} and
+      C{JSONEncoder} classes.
+    """
+    self.name = name
+    self.module = module
+    self.decoder = module.JSONDecoder(strict=False)
+    self.encoder = module.JSONEncoder()
+
+  def __repr__(self):
+    return '<JSONBackend[%s]>' % self.name
+
+  def decode(self, string):
+    return self.decoder.decode(string)
+
+  def encode(self, value):
+    return self.encoder.encode(value)
+
+def _has_speedups(module):
+  scanner = getattr(module, 'scanner', None)
+  return getattr(scanner, 'c_make_scanner', None) is not None
+
+def _select_json_backend():
+  """Picks the fastest JSON implementation available."""
+  if _has_speedups(simplejson):
+    return JSONBackend('simplejson (C speedups)', simplejson)
+  if _stdlib_json and _has_speedups(_stdlib_json):
+    return JSONBackend('json (C speedups)', _stdlib_json)
+  return JSONBackend('simplejson (pure Python)', simplejson)
+
+# The JSON implementation used by every client.  Its name says which one was
+# picked; assign another JSONBackend to use something else.
+JSON_BACKEND = _select_json_backend()
+
+_JSON_WHITESPACE = re.compile('[ \\t\\n\\r]*')
+
+class _JSONStream:
+  """
+  Decodes a JSON response as it comes off the socket, handing over each
+  element of the C{items} array, or of C{entry} or C{results} for other
+  feeds, as soon as it has arrived in full.  Everything else in the response
+  is collected into C{envelope}, with the streamed array left empty.  Only
+  the element being decoded is ever buffered.
+  """
+  _chunk_size = 16 * 1024
+  _array_keys = ('items', 'entry', 'results')
+
+  def __init__(self, response, decoder):
+    self._response = response
+    self._decoder = decoder
+    self._buffer = ''
+    self._offset = 0
+    self._eof = False
+    self._streamed = False
+    self.envelope = None
+
+  def _fill(self):
+    if self._eof:
+      return False
+    data = self._response.read(self._chunk_size)
+    if not data:
+      self._eof = True
+      return False
+    # Drop whatever has already been decoded
+    self._buffer = self._buffer[self._offset:] + data
+    self._offset = 0
+    return True
+
+  def _peek(self):
+    """Skips whitespace and returns the next character."""
+    while True:
+      self._offset = _JSON_WHITESPACE.match(self._buffer, self._offset).end()
+      if self._offset < len(self._buffer):
+        return self._buffer[self._offset]
+      if not self._fill():
+        raise ValueError('Unexpected end of JSON data')
+
+  def _expect(self, characters):
+    char = self._peek()
+    if char not in characters:
+      raise ValueError(
+        'Expected %s at offset %d but found %r' % (
+          ' or '.join(characters), self._offset, char
+        )
+      )
+    self._offset += 1
+    return char
+
+  def _value(self):
+    """Decodes the complete JSON value that starts at the current offset."""
+    self._peek()
+    while True:
+      try:
+        value, end = self._decoder.raw_decode(self._buffer, self._offset)
+      except ValueError:
+        # Most likely the value continues in the next chunk
+        if not self._fill():
+          raise
+        continue
+      # A number cut off by the end of the buffer may not be finished yet
+      if isinstance(value, (int, long, float)) and \
+          not isinstance(value, bool) and \
+          (end == len(self._buffer) or self._buffer[end] in '.eE') and \
+          self._fill():
+        continue
+      self._offset = end
+      return value
+
+  def items(self):
+    """Yields each element of the streamed array as it's decoded."""
+    if self._peek() != '{':
+      self.envelope = self._value()
+      return
+    self.envelope = {}
+    for item in self._object(self.envelope, 0):
+      yield item
+
+  def _object(self, target, depth):
+    self._expect('{')
+    if self._peek() == '}':
+      self._offset += 1
+      return
+    while True:
+      if self._peek() != '"':
+        self._expect('"')
+      key = self._value()
+      self._expect(':')
+      char = self._peek()
+      if depth == 0 and key == 'data' and char == '{':
+        target[key] = {}
+        for item in self._object(target[key], depth + 1):
+          yield item
+      elif key in self._array_keys and char == '[' and not self._streamed:
+        self._streamed = True
+        target[key] = []
+        for item in self._array():
+          yield item
+      else:
+        target[key] = self._value()
+      if self._expect(',}') == '}':
+        return
+
+  def _array(self):
+    self._expect('[')
+    if self._peek() == ']':
+      self._offset += 1
+      return
+    while True:
+      yield self._value()
+      if self._expect(',]') == ']':
+        return
+
+class _CacheEntry:
+  def __init__(self, json, size, expires, etag=None, last_modified=None):
+    self.json = json
+    self.size = size
+    self.expires = expires
+    self.etag = etag
+    self.last_modified = last_modified
+
+class ResponseCache:
+  """
+  The L{ResponseCache} object keeps recently fetched GET responses in memory,
+  so that repeated lookups of rarely changing data, such as profiles and
+  albums, don't go back to the network.  Entries are keyed by canonical URI
+  and by the credentials they were fetched with, expire after a per-endpoint
+  TTL, and are evicted least recently used first once either the entry or
+  byte limit is reached.  Expired entries which came with an C{ETag} or
+  C{Last-Modified} header are kept around so that they can be revalidated
+  with a conditional GET.  Assign one to a client's C{response_cache}
+  attribute to use it; it may be shared by many clients and threads.
+  """
+  def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES,
+      max_bytes=DEFAULT_CACHE_BYTES, ttl=DEFAULT_CACHE_TTL, ttls=None):
+    """
+    @type max_entries: int
+    @param max_entries: The most responses to keep.
+    @type max_bytes: int
+    @param max_bytes: The most response body bytes to keep.
+    @type ttl: float
+    @param ttl: How long responses stay fresh, in seconds, for endpoints not
+      listed in C{ttls}.  Zero disables caching for those endpoints.
+    @type ttls: dict
+    @param ttls: TTLs keyed by L{Client} method name, e.g.
+      C{{'person': 3600, 'posts': 0}}.
+    """
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.ttls = ttls or {}
+    self._entries = collections.OrderedDict()
+    self._bytes = 0
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def ttl_for(self, endpoint):
+    return self.ttls.get(endpoint, self.ttl)
+
+  def get(self, key):
+    """Returns the fresh JSON cached for C{key}, or C{None}."""
+    self._lock.acquire()
+    try:
+      entry = self._entries.pop(key, None)
+      if entry and entry.expires <= time.time():
+        if entry.etag or entry.last_modified:
+          # Keep it for revalidation
+          self._entries[key] = entry
+        else:
+          self._bytes -= entry.size
+        entry = None
+      if not entry:
+        self.misses += 1
+        return None
+      # Move it to the most recently used end
+      self._entries[key] = entry
+      self.hits += 1
+      return entry.json
+    finally:
+      self._lock.release()
+
+  def stale(self, key):
+    """
+    Returns the entry for C{key} whether or not it's still fresh, so that its
+    C{etag} and C{last_modified} validators can be sent with a conditional
+    GET.  Returns C{None} if nothing is cached.
+    """
+    self._lock.acquire()
+    try:
+      return self._entries.get(key)
+    finally:
+      self._lock.release()
+
+  def revalidated(self, key, endpoint=None):
+    """Marks an entry as fresh again after the server sent a 304."""
+    ttl = self.ttl_for(endpoint)
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(key)
+      if entry:
+        entry.expires = time.time() + ttl
+    finally:
+      self._lock.release()
+
+  def put(self, key, json, size, endpoint=None, etag=None,
+      last_modified=None):
+    """Caches the JSON of a response whose body was C{size} bytes long."""
+    ttl = self.ttl_for(endpoint)
+    if not ttl or size > self.max_bytes:
+      return
+    self._lock.acquire()
+    try:
+      old_entry = self._entries.pop(key, None)
+      if old_entry:
+        self._bytes -= old_entry.size
+      self._entries[key] = _CacheEntry(
+        json, size, time.time() + ttl, etag, last_modified
+      )
+      self._bytes += size
+      while len(self._entries) > self.max_entries or \
+          self._bytes > self.max_bytes:
+        evicted_key, evicted = self._entries.popitem(last=False)
+        self._bytes -= evicted.size
+        self.evictions += 1
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._entries.clear()
+      self._bytes = 0
+    finally:
+      self._lock.release()
+
+  def stats(self):
+    """Returns the hit, miss and eviction counters and the cache's size."""
+    self._lock.acquire()
+    try:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'entries': len(self._entries),
+        'bytes': self._bytes
+      }
+    finally:
+      self._lock.release()
+
+class Future:
+  """
+  The L{Future} object holds the eventual outcome of a call submitted to a
+  L{WorkerPool}.
+  """
+  def __init__(self):
+    self._condition = threading.Condition()
+    self._done = False
+    self._value = None
+    self._exc_info = None
+    self._callbacks = []
+
+  def done(self):
+    return self._done
+
+  def _wait(self, timeout):
+    self._condition.acquire()
+    try:
+      if not self._done:
+        self._condition.wait(timeout)
+      if not self._done:
+        raise RetrieveError(message='Timed out waiting for result')
+    finally:
+      self._condition.release()
+
+  def result(self, timeout=None):
+    """
+    Returns the value of the call, waiting for it to finish if necessary.  If
+    the call raised an exception, that exception is raised here instead.
+    """
+    self._wait(timeout)
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._value
+
+  def exception(self, timeout=None):
+    """Returns the exception raised by the call, or C{None}."""
+    self._wait(timeout)
+    if self._exc_info:
+      return self._exc_info[1]
+    return None
+
+  def add_done_callback(self, callback):
+    """
+    Arranges for C{callback(future)} to be called once the call finishes.
+    If it already has, the callback is called immediately.
+    """
+    self._condition.acquire()
+    try:
+      if not self._done:
+        self._callbacks.append(callback)
+        return
+    finally:
+      self._condition.release()
+    callback(self)
+
+  def _finish(self, value=None, exc_info=None):
+    self._condition.acquire()
+    try:
+      self._value = value
+      self._exc_info = exc_info
+      self._done = True
+      self._condition.notifyAll()
+      callbacks = self._callbacks
+      self._callbacks = []
+    finally:
+      self._condition.release()
+    for callback in callbacks:
+      try:
+        callback(self)
+      except Exception:
+        logging.exception('Future callback failed')
+
+class WorkerPool:
+  """
+  The L{WorkerPool} object runs calls on a bounded set of daemon threads.
+  Threads are only started as they're needed, up to C{max_workers}.
+  """
+  def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+    self.max_workers = max_workers
+    self._tasks = Queue.Queue()
+    self._lock = threading.Lock()
+    self._workers = 0
+    self._idle = 0
+    self._shutdown = False
+
+  def submit(self, function, *args, **kwargs):
+    """Schedules C{function(*args, **kwargs)} and returns its L{Future}."""
+    if self._shutdown:
+      raise ValueError('Cannot submit calls to a shut down WorkerPool.')
+    future = Future()
+    self._tasks.put((future, function, args, kwargs))
+    self._lock.acquire()
+    try:
+      start_worker = self._idle == 0 and self._workers < self.max_workers
+      if start_worker:
+        self._workers += 1
+    finally:
+      self._lock.release()
+    if start_worker:
+      thread = threading.Thread(target=self._work)
+      thread.setDaemon(True)
+      thread.start()
+    return future
+
+  def _work(self):
+    while True:
+      self._lock.acquire()
+      self._idle += 1
+      self._lock.release()
+      task = self._tasks.get()
+      self._lock.acquire()
+      self._idle -= 1
+      self._lock.release()
+      if task is None:
+        break
+      future, function, args, kwargs = task
+      try:
+        value = function(*args, **kwargs)
+      except Exception:
+        future._finish(exc_info=sys.exc_info())
+      else:
+        future._finish(value=value)
+    self._lock.acquire()
+    self._workers -= 1
+    self._lock.release()
+
+  def shutdown(self, cancel=False):
+    """
+    Lets the worker threads exit once the calls already queued are done.  If
+    C{cancel} is set, calls that haven't started yet are abandoned instead.
+    """
+    if cancel:
+      exits = 0
+      try:
+        while True:
+          task = self._tasks.get_nowait()
+          if task is None:
+            # A worker has already been told to exit
+            exits += 1
+            continue
+          try:
+            raise RetrieveError(message='Call was cancelled')
+          except RetrieveError:
+            task[0]._finish(exc_info=sys.exc_info())
+      except Queue.Empty:
+        pass
+      for i in range(exits):
+        self._tasks.put(None)
+    if self._shutdown:
+      return
+    self._shutdown = True
+    self._lock.acquire()
+    try:
+      workers = self._workers
+    finally:
+      self._lock.release()
+    for i in range(workers):
+      self._tasks.put(None)
+
+class RetryPolicy:
+  """
+  The L{RetryPolicy} object decides whether a failed API request should be
+  tried again, and how long to wait before doing so.  Network errors and
+  retryable statuses are retried with exponential backoff and full jitter,
+  unless the server asks for a specific delay with a C{Retry-After} header.
+
+  Every retry is paid for out of a budget which is topped up by a fraction of
+  a token for each request made, so that retries can never multiply the load
+  on a server that is already struggling.
+  """
+  def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_base=0.5,
+      backoff_max=30.0, max_retry_after=120.0,
+      retry_statuses=(500, 502, 503, 504),
+      retry_methods=('GET', 'HEAD', 'PUT', 'DELETE'),
+      budget_ratio=0.2, budget_max=10.0):
+    """
+    @type max_retries: int
+    @param max_retries: How many times a single request may be retried.
+    @type backoff_base: float
+    @param backoff_base: The backoff ceiling for the first retry, in seconds.
+      It doubles with every further retry.
+    @type backoff_max: float
+    @param backoff_max: The largest backoff ceiling, in seconds.
+    @type max_retry_after: float
+    @param max_retry_after: Requests asking for a longer C{Retry-After} than
+      this are not retried.
+    @type retry_statuses: tuple
+    @param retry_statuses: The HTTP statuses worth retrying.
+    @type retry_methods: tuple
+    @param retry_methods: The HTTP methods that are safe to send twice.
+    @type budget_ratio: float
+    @param budget_ratio: The budget earned by each request.  0.2 allows one
+      retry for every five requests once the initial budget is spent.
+    @type budget_max: float
+    @param budget_max: The initial, and largest, budget.
+    """
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.max_retry_after = max_retry_after
+    self.retry_statuses = retry_statuses
+    self.retry_methods = retry_methods
+    self.budget_ratio = budget_ratio
+    self.budget_max = budget_max
+    self._budget = budget_max
+    self._lock = threading.Lock()
+
+  def record_request(self):
+    """Tops up the retry budget for a newly made request."""
+    self._lock.acquire()
+    try:
+      self._budget = min(self._budget + self.budget_ratio, self.budget_max)
+    finally:
+      self._lock.release()
+
+  def _spend_budget(self):
+    self._lock.acquire()
+    try:
+      if self._budget < 1:
+        return False
+      self._budget -= 1
+      return True
+    finally:
+      self._lock.release()
+
+  def _parse_retry_after(self, retry_after):
+    # Either a number of seconds or an HTTP date
+    try:
+      return max(float(retry_after), 0.0)
+    except ValueError:
+      parsed = email.utils.parsedate_tz(retry_after)
+      if not parsed:
+        return None
+      return max(email.utils.mktime_tz(parsed) - time.time(), 0.0)
+
+  def retry_delay(self, http_method, attempt, status=None, retry_after=None):
+    """
+    Returns how many seconds to wait before retrying a request, or C{None} if
+    it shouldn't be retried.  A C{status} of C{None} means that the request
+    failed with a network error.
+    """
+    if attempt >= self.max_retries:
+      return None
+    if http_method.upper() not in self.retry_methods:
+      return None
+    if status is not None and status not in self.retry_statuses:
+      return None
+    delay = None
+    if retry_after:
+      delay = self._parse_retry_after(retry_after)
+      if delay is not None and delay > self.max_retry_after:
+        return None
+    if delay is None:
+      ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+      delay = random.uniform(0, ceiling)
+    if not self._spend_budget():
+      return None
+    return delay
+
+class _TokenBucket:
+  def __init__(self, rate, capacity, now):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = now
+
+  def refill(self, now):
+    self.tokens = min(
+      self.capacity, self.tokens + (now - self.updated) * self.rate
+    )
+    self.updated = now
+
+  def take(self):
+    """Takes a token, going into debt if need be, and returns the wait."""
+    self.tokens -= 1
+    if self.tokens >= 0:
+      return 0.0
+    return -self.tokens / self.rate
+
+class RateLimiter:
+  """
+  The L{RateLimiter} object paces API requests with token buckets, one per
+  OAuth consumer key and one per access token, so that a busy application
+  stays just under its quota rather than running into throttling.  A single
+  L{RateLimiter} may be shared by any number of threads and L{Client}
+  objects; assign it to each client's C{rate_limiter} attribute.
+  """
+  # Beyond this many buckets, those that have filled back up are dropped
+  _max_idle_buckets = 10000
+
+  def __init__(self, consumer_rate=None, token_rate=None,
+      consumer_burst=None, token_burst=None):
+    """
+    @type consumer_rate: float
+    @param consumer_rate: Requests per second allowed for each consumer key,
+      or C{None} for no limit.
+    @type token_rate: float
+    @param token_rate: Requests per second allowed for each access token, or
+      C{None} for no limit.
+    @type consumer_burst: float
+    @param consumer_burst: How many requests a consumer may make at once.
+      Defaults to one second's worth.
+    @type token_burst: float
+    @param token_burst: How many requests an access token may make at once.
+      Defaults to one second's worth.
+    """
+    self.consumer_rate = consumer_rate
+    self.token_rate = token_rate
+    self.consumer_burst = consumer_burst or consumer_rate
+    self.token_burst = token_burst or token_rate
+    self._consumer_buckets = {}
+    self._token_buckets = {}
+    self._lock = threading.Lock()
+    self._requests = 0
+    self._delayed_requests = 0
+    self._total_wait = 0.0
+    self._max_wait = 0.0
+
+  def _take(self, buckets, key, rate, burst, now):
+    bucket = buckets.get(key)
+    if not bucket:
+      if len(buckets) > self._max_idle_buckets:
+        for idle_key, idle_bucket in buckets.items():
+          idle_bucket.refill(now)
+          if idle_bucket.tokens >= idle_bucket.capacity:
+            del buckets[idle_key]
+      bucket = _TokenBucket(rate, burst, now)
+      buckets[key] = bucket
+    bucket.refill(now)
+    return bucket.take()
+
+  def acquire(self, consumer_key=None, token_key=None):
+    """
+    Waits until a request may be sent on behalf of the given consumer key and
+    access token, and returns the number of seconds spent waiting.
+    """
+    self._lock.acquire()
+    try:
+      now = time.time()
+      wait = 0.0
+      if self.consumer_rate:
+        wait = max(wait, self._take(
+          self._consumer_buckets, consumer_key,
+          self.consumer_rate, self.consumer_burst, now
+        ))
+      if self.token_rate and token_key:
+        wait = max(wait, self._take(
+          self._token_buckets, token_key,
+          self.token_rate, self.token_burst, now
+        ))
+      self._requests += 1
+      if wait > 0:
+        self._delayed_requests += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+    finally:
+      self._lock.release()
+    if wait > 0:
+      time.sleep(wait)
+    return wait
+
+  def stats(self):
+    """Returns how many requests have been paced, and how long they waited."""
+    self._lock.acquire()
+    try:
+      if self._requests:
+        mean_wait = self._total_wait / self._requests
+      else:
+        mean_wait = 0.0
+      return {
+        'requests': self._requests,
+        'delayed_requests': self._delayed_requests,
+        'total_wait': self._total_wait,
+        'mean_wait': mean_wait,
+        'max_wait': self._max_wait
+      }
+    finally:
+      self._lock.release()
+
+class SingleFlight:
+  """
+  The L{SingleFlight} object lets concurrent identical calls share a single
+  execution.  The first caller for a key does the work; anyone else asking
+  for the same key while it's in progress waits for, and receives, the same
+  value or exception.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls = {}
+
+  def do(self, key, function, *args, **kwargs):
+    self._lock.acquire()
+    try:
+      future = self._calls.get(key)
+      leader = future is None
+      if leader:
+        future = Future()
+        self._calls[key] = future
+    finally:
+      self._lock.release()
+    if leader:
+      try:
+        value = function(*args, **kwargs)
+      except Exception:
+        future._finish(exc_info=sys.exc_info())
+      else:
+        future._finish(value=value)
+      self._lock.acquire()
+      try:
+        del self._calls[key]
+      finally:
+        self._lock.release()
+    return future.result()
+
+# The request line of a part of a multipart batch
+_PART_REQUEST_LINE = re.compile('^([A-Z]+) (\\S+) (HTTP/1\\.[01]\r?)$', re.M)
+
+class Cassette:
+  """
+  The L{Cassette} object is a transport for L{Client.transport} which records
+  API requests and their responses to a file, and replays them later without
+  touching the network.  Requests are matched on their method, URI and body,
+  whatever the order of the query parameters.  The OAuth signature, which is
+  different every time, isn't part of the match, and neither is the API key,
+  which is never recorded.  A request that was made several times gets each
+  recorded response in turn, then the last one again.
+  """
+  def __init__(self, path, record=False, latency=0, recorded_latency=False):
+    """
+    @type path: string
+    @param path: The cassette file.  Without one, the cassette starts out
+      empty, and responses for it to replay can be given to L{add}.
+    @type record: bool
+    @param record: Whether to make real requests and record them rather than
+      replaying the file.  Nothing is written until L{save} is called, which
+      replaces whatever the file held.
+    @type latency: float
+    @param latency: Seconds to wait before handing over each replayed
+      response, to simulate a network.
+    @type recorded_latency: bool
+    @param recorded_latency: Whether to also wait for as long as each
+      response originally took to arrive.
+    """
+    self.path = path
+    self.record = record
+    self.latency = latency
+    self.recorded_latency = recorded_latency
+    self._lock = threading.Lock()
+    self._interactions = []
+    self._responses = {}
+    self._replayed = {}
+    if path and not record:
+      self.load()
+
+  def _key(self, http_method, http_uri, http_body):
+    return (
+      http_method, self._scrub(http_method, http_uri).key,
+      self._scrub_body(http_body)
+    )
+
+  def _scrub_params(self, params):
+    return [
+      (name, value) for name, value in params
+      if name != 'key' and not name.startswith('oauth_')
+    ]
+
+  def _scrub(self, http_method, http_uri):
+    """
+    Returns the request for a URI without the credentials that clients add
+    to it, so they're never written to the cassette and any client can
+    replay it.
+    """
+    request = _APIRequest.from_uri(http_method, http_uri)
+    params = self._scrub_params(request.params)
+    if len(params) == len(request.params):
+      return request
+    return _APIRequest(
+      http_method, request.path, params=params, prefix=request.prefix
+    )
+
+  def _scrub_body(self, http_body):
+    """
+    Returns a body without credentials.  Only the requests within a
+    multipart batch have any; their boundary, which depends on them, is
+    replaced as well.
+    """
+    if not http_body or not http_body.startswith('--'):
+      return http_body
+    boundary = http_body[2:].split('\r\n', 1)[0]
+    def scrub_line(match):
+      path = match.group(2)
+      if '?' in path:
+        location, query = path.split('?', 1)
+        pairs = _query_pairs(query)
+        params = self._scrub_params(pairs)
+        if len(params) != len(pairs):
+          path = location
+          if params:
+            path += '?' + '&'.join([
+              _query_escape(name) + '=' + _query_escape(value)
+              for name, value in params
+            ])
+      return '%s %s %s' % (match.group(1), path, match.group(3))
+    return _PART_REQUEST_LINE.sub(
+      scrub_line, http_body.replace(boundary, 'batch')
+    )
+
+  def load(self):
+    """Reads the recorded interactions from the cassette file."""
+    json = JSON_BACKEND.decode(open(self.path).read())
+    self._lock.acquire()
+    try:
+      self._interactions = []
+      self._responses = {}
+      self._replayed = {}
+      for interaction in json.get('interactions', []):
+        self._add(interaction)
+    finally:
+      self._lock.release()
+
+  def save(self):
+    """Writes every recorded interaction to the cassette file."""
+    self._lock.acquire()
+    try:
+      data = JSON_BACKEND.encode({'interactions': self._interactions})
+      # Writing under the lock means an older snapshot never wins
+      cassette_file = open(self.path, 'w')
+      try:
+        cassette_file.write(data)
+      finally:
+        cassette_file.close()
+    finally:
+      self._lock.release()
+
+  def _add(self, interaction):
+    request = interaction['request']
+    key = self._key(request['method'], request['uri'], request['body'])
+    self._interactions.append(interaction)
+    self._responses.setdefault(key, []).append(interaction)
+
+  def add(self, http_method, http_uri, status, body, headers=None,
+      reason='', http_body='', elapsed=0):
+    """Records a response to a request, as if it had been made."""
+    try:
+      body.decode('utf-8')
+      response = {'body': body}
+    except UnicodeDecodeError:
+      # Compressed responses aren't text
+      response = {'body_base64': binascii.b2a_base64(body)}
+    response.update({
+      'status': status,
+      'reason': reason,
+      'headers': dict(headers or {})
+    })
+    self._lock.acquire()
+    try:
+      self._add({
+        'request': {
+          'method': http_method,
+          'uri': self._scrub(http_method, http_uri).uri,
+          'body': self._scrub_body(http_body)
+        },
+        'response': response,
+        'elapsed': elapsed
+      })
+    finally:
+      self._lock.release()
+
+  def fetch(self, client, http_method, http_uri, http_headers, http_body):
+    """Sends a request on behalf of C{client}, or replays its response."""
+    if self.record:
+      start = time.time()
+      response = client._fetch_pooled_response(
+        http_method, http_uri, http_headers, http_body
+      )
+      body = response.read()
+      elapsed = time.time() - start
+      headers = dict(response.getheaders())
+      self.add(
+        http_method, http_uri, response.status, body, headers=headers,
+        reason=response.reason, http_body=http_body, elapsed=elapsed
+      )
+      return _BufferedResponse(response.status, response.reason, headers, body)
+    key = self._key(http_method, http_uri, http_body)
+    self._lock.acquire()
+    try:
+      recorded = self._responses.get(key)
+      if recorded:
+        index = self._replayed.get(key, 0)
+        self._replayed[key] = index + 1
+        interaction = recorded[min(index, len(recorded) - 1)]
+    finally:
+      self._lock.release()
+    if not recorded:
+      raise RetrieveError(
+        uri=http_uri,
+        message='No recorded response in %s' % (self.path or 'the cassette')
+      )
+    delay = self.latency
+    if self.recorded_latency:
+      delay += interaction.get('elapsed') or 0
+    if delay > 0:
+      time.sleep(delay)
+    response = interaction['response']
+    if 'body_base64' in response:
+      body = binascii.a2b_base64(response['body_base64'])
+    else:
+      body = response['body'].encode('utf-8')
+    return _BufferedResponse(
+      response['status'], response['reason'], response['headers'], body
+    )
+
+# The transport that new clients are given, e.g. a Cassette to run offline
+DEFAULT_TRANSPORT = None
+
+def _query_pairs(query):
+  """Parses a query string into C{(name, value)} pairs, keeping blanks."""
+  # Buzz gives non-strict conforming next uris, like:
+  # https://www.googleapis.com/buzz/v1/activities/search?q&lon=1123&lat=456&max-results=2&c=2
+  if hasattr(urlparse, 'parse_qsl'):
+    return urlparse.parse_qsl(query, keep_blank_values=True)
+  else:
+    # Deprecated in 2.6
+    return cgi.parse_qsl(query, keep_blank_values=True)
+
+def _query_parameters(query):
+  """
+  Parses a query string into the parameters that get signed.  Blank values
+  are kept, and only the first value of a repeated parameter counts.
+  """
+  parameters = {}
+  for key, value in _query_pairs(query):
+    parameters.setdefault(key, value)
+  return parameters
+
+def _oauth_escape(value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  return urllib.quote(str(value), safe='~')
+
+class OAuthSigner:
+  """
+  The L{OAuthSigner} object signs API requests for one consumer and access
+  token with HMAC-SHA1, producing the same signature base string as the
+  OAuth library.  Everything that's the same for every request, such as the
+  escaped keys and the keyed HMAC, is prepared once, and each signature
+  starts from a copy of that HMAC.  It's safe to share between threads.
+  """
+  def __init__(self, consumer, token=None):
+    """
+    @type consumer: oauth.OAuthConsumer
+    @param consumer: The consumer to sign for.
+    @type token: oauth.OAuthToken
+    @param token: The access token to sign for, if any.
+    """
+    self.consumer = consumer
+    self.token = token
+    key = _oauth_escape(consumer.secret) + '&'
+    # The escaped OAuth parameters that never change
+    self._parameters = [
+      ('oauth_consumer_key', _oauth_escape(consumer.key)),
+      ('oauth_signature_method', 'HMAC-SHA1'),
+      ('oauth_version', _oauth_escape(oauth.OAuthRequest.version))
+    ]
+    if token:
+      key += _oauth_escape(token.secret)
+      self._parameters.append(('oauth_token', _oauth_escape(token.key)))
+      if token.callback:
+        self._parameters.append(
+          ('oauth_callback', _oauth_escape(token.callback))
+        )
+    self._hmac = hmac.new(key, digestmod=_sha1)
+
+  def sign(self, http_method, http_uri, parameters=None, nonce=None,
+      timestamp=None):
+    """
+    Returns the escaped OAuth parameters for a request as a list of
+    C{(name, value)} pairs, signature included.
+
+    @type http_method: string
+    @param http_method: The HTTP method of the request.
+    @type http_uri: string
+    @param http_uri: The URI of the request.
+    @type parameters: dict
+    @param parameters: The query parameters of the request.  If omitted,
+      they are parsed from C{http_uri}.
+    """
+    if nonce is None:
+      nonce = str(random.getrandbits(64))
+    if timestamp is None:
+      timestamp = int(time.time())
+    parts = urlparse.urlparse(http_uri)
+    scheme, netloc, path = parts[:3]
+    if parameters is None:
+      parameters = _query_parameters(parts[4])
+    oauth_parameters = self._parameters + [
+      ('oauth_nonce', _oauth_escape(nonce)),
+      ('oauth_timestamp', _oauth_escape(timestamp))
+    ]
+    pairs = [
+      (_oauth_escape(key), _oauth_escape(value))
+      for key, value in parameters.items()
+    ] + oauth_parameters
+    pairs.sort()
+    # Exclude default port numbers
+    if scheme == 'http' and netloc[-3:] == ':80':
+      netloc = netloc[:-3]
+    elif scheme == 'https' and netloc[-4:] == ':443':
+      netloc = netloc[:-4]
+    base_string = '&'.join([
+      _oauth_escape(http_method.upper()),
+      _oauth_escape('%s://%s%s' % (scheme, netloc, path)),
+      _oauth_escape('&'.join(['%s=%s' % pair for pair in pairs]))
+    ])
+    hashed = self._hmac.copy()
+    hashed.update(base_string)
+    signature = binascii.b2a_base64(hashed.digest())[:-1]
+    return oauth_parameters + [('oauth_signature', _oauth_escape(signature))]
+
+  def header(self, http_method, http_uri, parameters=None):
+    """Returns the C{Authorization} header for a request, as a C{dict}."""
+    return {'Authorization': 'OAuth realm=""' + ''.join([
+      ', %s="%s"' % pair
+      for pair in self.sign(http_method, http_uri, parameters)
+    ])}
+
+# The query parameters every request starts with, for compact JSON output
+_JSON_PARAMS = (('alt', 'json'), ('prettyPrint', 'false'))
+
+def _query_escape(value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  return urllib.quote_plus(str(value))
+
+class _APIRequest(object):
+  """
+  An API request kept as structured data: the HTTP method, a path template
+  and its arguments, the query parameters in order, and the body.  Endpoint
+  methods build one of these rather than concatenating a URI, which is then
+  formatted only once, when it's first needed.  The query parameters are
+  handed to the L{OAuthSigner} as they are, so nothing has to be parsed back
+  out of the URI.  Requests never change once built, and equal requests hash
+  alike, so they can be compared and used as cache keys.
+  """
+  __slots__ = ('http_method', 'prefix', 'path', 'path_args', 'params',
+    'http_body', '_uri', '_parameters', '_key')
+
+  def __init__(self, http_method, path, path_args=(), params=(),
+      http_body='', prefix=None):
+    """
+    @type http_method: string
+    @param http_method: The HTTP method of the request.
+    @type path: string
+    @param path: The path, relative to C{prefix}.  If there are any
+      C{path_args}, this is a template for them, e.g. C{'/people/%s/@self'}.
+    @type params: list
+    @param params: The query parameters as C{(name, value)} pairs, unescaped.
+      Parameters with a value of C{None} are left out.
+    @type prefix: string
+    @param prefix: The URI the path is relative to.  Defaults to
+      L{API_PREFIX}.
+    """
+    if prefix is None:
+      prefix = API_PREFIX
+    self.http_method = http_method
+    self.prefix = prefix
+    self.path = path
+    self.path_args = tuple(path_args)
+    self.params = tuple([
+      (name, isinstance(value, basestring) and value or str(value))
+      for name, value in params if value is not None
+    ])
+    self.http_body = http_body
+    self._uri = None
+    self._parameters = None
+    self._key = None
+
+  @classmethod
+  def from_uri(cls, http_method, uri, http_body=''):
+    """Builds a request for a URI that's already been formatted."""
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(uri)
+    request = cls(
+      http_method, path, params=_query_pairs(query), http_body=http_body,
+      prefix='%s://%s' % (scheme, netloc)
+    )
+    # Keep the URI exactly as it was given
+    request._uri = uri
+    return request
+
+  @property
+  def location(self):
+    """The URI of the request, without the query."""
+    if self.path_args:
+      return self.prefix + self.path % self.path_args
+    return self.prefix + self.path
+
+  @property
+  def uri(self):
+    if self._uri is None:
+      uri = self.location
+      if self.params:
+        uri += '?' + '&'.join([
+          _query_escape(name) + '=' + _query_escape(value)
+          for name, value in self.params
+        ])
+      self._uri = uri
+    return self._uri
+
+  @property
+  def parameters(self):
+    """
+    The query parameters as a C{dict}, as they are signed.  Only the first
+    value of a repeated parameter counts.
+    """
+    if self._parameters is None:
+      parameters = {}
+      for name, value in self.params:
+        parameters.setdefault(name, value)
+      self._parameters = parameters
+    return self._parameters
+
+  @property
+  def key(self):
+    """
+    Identifies the resource requested, whatever order the query parameters
+    are in.
+    """
+    if self._key is None:
+      scheme, rest = self.location.split('://', 1)
+      if '/' in rest:
+        netloc, path = rest.split('/', 1)
+        path = '/' + path
+      else:
+        netloc, path = rest, ''
+      self._key = ('%s://%s%s' % (scheme.lower(), netloc.lower(), path),
+        tuple(sorted(self.params)))
+    return self._key
+
+  def with_param(self, name, value, first=False):
+    """
+    Returns a copy of this request with the query parameter C{name} set to
+    C{value}.  A new parameter goes at the end of the query, or at the start
+    with C{first}.
+    """
+    params = list(self.params)
+    for i in range(len(params)):
+      if params[i][0] == name:
+        params[i] = (name, value)
+        break
+    else:
+      if first:
+        params.insert(0, (name, value))
+      else:
+        params.append((name, value))
+    return _APIRequest(
+      self.http_method, self.path, self.path_args, params,
+      http_body=self.http_body, prefix=self.prefix
+    )
+
+  def __eq__(self, other):
+    if not isinstance(other, _APIRequest):
+      return NotImplemented
+    return self.http_method == other.http_method and \
+      self.key == other.key and self.http_body == other.http_body
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    if equal is NotImplemented:
+      return equal
+    return not equal
+
+  def __hash__(self):
+    return hash((self.http_method, self.key, self.http_body))
+
+  def __repr__(self):
+    return '<_APIRequest %s %s>' % (self.http_method, self.uri)
+
 class Client:
   """
   The Buzz API L{Client} object is the primary method of making calls against
   the Buzz API. It can be used with or without authentication. It attempts to
-  reuse HTTP connections whenever possible. Currently, authentication is done
-  via OAuth.
+  reuse HTTP connections whenever possible, and a single L{Client} may be
+  shared by many threads. Currently, authentication is done via OAuth.
   """
-  def __init__(self):
+  def __init__(self, connection_pool=None, share_connections=True):
+    """
+    @type connection_pool: L{ConnectionPool}
+    @param connection_pool: The pool to take API connections from.
+    @type share_connections: bool
+    @param share_connections: When no pool is given, whether to use the
+      process-wide L{SHARED_CONNECTION_POOL} or a pool private to this client.
+    """
     # Make sure we're always getting the right HTTP connection, even if
     # API_PREFIX changes
-    parsed = urlparse.urlparse(API_PREFIX)
-    authority = parsed[1].split(':')
-    if len(authority) == 1:
-      # Incidentally, this is why unpacking shouldn't complain about
-      # size mismatch on the array.  Bad Python.  Stop trying to protect me!
-      self._host = authority[0]
-      self._port = None
-    else:
-      self._host, self._port = authority
-    if not self._port:
-      if parsed[0] == 'https':
-        self._port = 443
-      else:
-        self._port = 80
+    authority = _api_prefix_authorities.get(API_PREFIX)
+    if not authority:
+      authority = _parse_authority(API_PREFIX)
+      _api_prefix_authorities[API_PREFIX] = authority
+    scheme, self._host, self._port = authority
 
     self._http_connection = None
+    self.retry_policy = RetryPolicy()
+    self.rate_limiter = None
+    # Sends API requests instead of the connection pool when set, e.g. a
+    # Cassette.  Transports have a fetch(client, http_method, http_uri,
+    # http_headers, http_body) method that returns the response.
+    self.transport = DEFAULT_TRANSPORT
+    # Concurrent identical GETs share one round trip and one parsed result
+    self.single_flight = SingleFlight()
+    self.response_cache = None
+    # Ask for gzip or deflate encoded responses
+    self.compress_responses = True
+    # Whether parsed objects hold on to the JSON they were decoded from.
+    # Without it, every field is decoded up front and the JSON is let go.
+    self.retain_json = True
+    # Every Person this client has built and that's still in use, by id
+    self._people = weakref.WeakValueDictionary()
+    self._people_lock = threading.Lock()
+    if connection_pool:
+      self.connection_pool = connection_pool
+    elif share_connections:
+      self.connection_pool = SHARED_CONNECTION_POOL
+    else:
+      self.connection_pool = ConnectionPool()
 
     self.api_key = None
 
@@ -289,6 +1881,7 @@ class Client:
     self._oauth_token_authorized = False
     self._oauth_signature_method_hmac_sha1 = \
       oauth.OAuthSignatureMethod_HMAC_SHA1()
+    self._oauth_signer = None
 
   @property
   def http_connection(self):
@@ -468,28 +2061,24 @@ class Client:
         raise Exception('Failed to obtain access token:\n' + response.read())
     return self.oauth_access_token
 
+  @property
+  def oauth_signer(self):
+    """
+    The L{OAuthSigner} for the current consumer and access token, which is
+    only rebuilt when either of them changes.
+    """
+    signer = self._oauth_signer
+    if not signer or signer.consumer is not self.oauth_consumer or \
+        signer.token is not self.oauth_access_token:
+      signer = OAuthSigner(self.oauth_consumer, self.oauth_access_token)
+      self._oauth_signer = signer
+    return signer
+
   def build_oauth_request(self, http_method, http_uri):
     # Query parameters have to be signed, and the OAuth library isn't smart
     # enough to do this automatically
     query = urlparse.urlparse(http_uri)[4] # Query is 4th element of the tuple
-    if query:
-      qs_parser = None
-      if hasattr(urlparse, 'parse_qs'):
-        qs_parser = urlparse.parse_qs
-      else:
-        # Deprecated in 2.6
-        qs_parser = cgi.parse_qs
-      # Buzz gives non-strict conforming next uris, like:
-      # https://www.googleapis.com/buzz/v1/activities/search?q&lon=1123&lat=456&max-results=2&c=2
-      parameters = qs_parser(
-        query,
-        keep_blank_values=True,
-        strict_parsing=False
-      )
-      for k, v in parameters.iteritems():
-        parameters[k] = v[0]
-    else:
-      parameters = {}
+    parameters = _query_parameters(query)
     # Build the OAuth request, add in our parameters, and sign it
     oauth_request = oauth.OAuthRequest.from_consumer_and_token(
       self.oauth_consumer,
@@ -505,13 +2094,52 @@ class Client:
     )
     return oauth_request
 
+  def _fetch_pooled_response(self, http_method, http_uri, http_headers,
+      http_body):
+    pool = self.connection_pool
+    scheme, host, port = _parse_authority(http_uri)
+    http_connection = pool.checkout(scheme, host, port)
+    try:
+      try:
+        http_connection.request(
+          http_method, http_uri,
+          headers=http_headers,
+          body=http_body
+        )
+        response = http_connection.getresponse()
+      except (httplib.BadStatusLine, httplib.CannotSendRequest):
+        # The server has probably closed an idle keep-alive connection
+        pool.discard(http_connection)
+        http_connection = None
+        http_connection = pool.checkout(scheme, host, port)
+        # Retry once
+        http_connection.request(
+          http_method, http_uri,
+          headers=http_headers,
+          body=http_body
+        )
+        response = http_connection.getresponse()
+    except:
+      if http_connection:
+        pool.discard(http_connection)
+      raise
+    return _PooledResponse(response, pool, http_connection)
+
   def fetch_api_response(self, http_method, http_uri, http_headers={}, \
                                http_connection=None, http_body=''):
-    if not http_connection:
-      http_connection = self.http_connection
+    # The caller's headers may be shared with other threads
+    http_headers = dict(http_headers)
     if not self.oauth_consumer and http_headers.get('Authorization'):
       del http_headers['Authorization']
-    if self.api_key:
+    parameters = None
+    if isinstance(http_uri, _APIRequest):
+      request = http_uri
+      if self.api_key:
+        request = request.with_param('key', self.api_key, first=True)
+      http_uri = request.uri
+      # The query parameters are already known, so nothing has to be parsed
+      parameters = request.parameters
+    elif self.api_key:
       # Is anyone else bothered by this?  I know I am.
       # It should *not* be this hard to insert a new query parameter correctly.
       # I must surely be missing something.
@@ -526,35 +2154,87 @@ class Client:
       'Content-Length': str(len(http_body))
     })
     if http_body:
-      http_headers.update({
-        'Content-Type': 'application/json'
-      })
-    if self.oauth_consumer and self.oauth_access_token:
-      # Build OAuth request and add OAuth header if we've got an access token
-      oauth_request = self.build_oauth_request(http_method, http_uri)
-      http_headers.update(oauth_request.to_header())
+      http_headers.setdefault('Content-Type', 'application/json')
+    if self.compress_responses and not http_headers.get('Accept-Encoding'):
+      http_headers['Accept-Encoding'] = 'gzip, deflate'
+      http_headers.setdefault('User-Agent', USER_AGENT)
+    policy = self.retry_policy
+    if policy and not http_connection:
+      policy.record_request()
+    attempt = 0
     try:
-      try:
-        http_connection.request(
-          http_method, http_uri,
-          headers=http_headers,
-          body=http_body
-        )
-        response = http_connection.getresponse()
-      except (httplib.BadStatusLine, httplib.CannotSendRequest):
-        if http_connection and http_connection == self.http_connection:
-          # Reset the connection
-          http_connection.close()
-          http_connection = None
-          self._http_connection = None
-          http_connection = self.http_connection
-          # Retry once
-          http_connection.request(
-            http_method, http_uri,
-            headers=http_headers,
-            body=http_body
+      while True:
+        if self.rate_limiter:
+          consumer_key = None
+          token_key = None
+          if self.oauth_consumer:
+            consumer_key = self.oauth_consumer.key
+          if self.oauth_access_token:
+            token_key = self.oauth_access_token.key
+          self.rate_limiter.acquire(consumer_key, token_key)
+        if self.oauth_consumer and self.oauth_access_token:
+          # Add OAuth header if we've got an access token.  Every attempt is
+          # signed afresh, with a new nonce.
+          http_headers.update(
+            self.oauth_signer.header(http_method, http_uri, parameters)
+          )
+        if http_connection and not self.transport:
+          try:
+            http_connection.request(
+              http_method, http_uri,
+              headers=http_headers,
+              body=http_body
+            )
+            response = http_connection.getresponse()
+          except (httplib.BadStatusLine, httplib.CannotSendRequest):
+            if http_connection and http_connection == self.http_connection:
+              # Reset the connection
+              http_connection.close()
+              http_connection = None
+              self._http_connection = None
+              http_connection = self.http_connection
+              # Retry once
+              http_connection.request(
+                http_method, http_uri,
+                headers=http_headers,
+                body=http_body
+              )
+              response = http_connection.getresponse()
+          break
+        try:
+          if self.transport:
+            response = self.transport.fetch(
+              self, http_method, http_uri, http_headers, http_body
+            )
+          else:
+            response = self._fetch_pooled_response(
+              http_method, http_uri, http_headers, http_body
+            )
+        except (socket.error, httplib.HTTPException):
+          if not policy:
+            raise
+          delay = policy.retry_delay(http_method, attempt)
+          if delay is None:
+            raise
+        else:
+          if not policy:
+            break
+          delay = policy.retry_delay(
+            http_method, attempt,
+            status=response.status,
+            retry_after=response.getheader('Retry-After')
           )
-          response = http_connection.getresponse()
+          if delay is None:
+            break
+          # Read the body so that the connection can be reused
+          response.read()
+        attempt += 1
+        logging.info('Retrying %s %s in %.2f seconds' % (
+          http_method, http_uri, delay
+        ))
+        time.sleep(delay)
+    except RetrieveError:
+      raise
     except Exception, e:
       if e.__class__.__name__ == 'ApplicationError' or \
           e.__class__.__name__ == 'DownloadError':
@@ -575,67 +2255,120 @@ class Client:
         message="%s: %s" % (e.__class__.__name__, message),
         json=json
       )
+    content_encoding = response.getheader('Content-Encoding')
+    if content_encoding:
+      content_encoding = content_encoding.strip().lower()
+      if content_encoding in ('gzip', 'x-gzip'):
+        response = _DecompressingResponse(response, 'gzip')
+      elif content_encoding == 'deflate':
+        response = _DecompressingResponse(response, 'deflate')
     return response
 
   # People APIs
 
-  def people_search(self, query=None):
-    api_endpoint = API_PREFIX + "/people/search?alt=json"
-    if query:
-      api_endpoint += "&q=" + urllib.quote_plus(query)
-    logging.info(api_endpoint)
-    return Result(self, 'GET', api_endpoint, result_type=Person)
+  def people_search(self, query=None, concurrency=DEFAULT_POCO_CONCURRENCY,
+      fields=None):
+    request = _APIRequest(
+      'GET', '/people/search',
+      params=self.__read_params(fields) + [('q', query or None)]
+    )
+    logging.info(request.uri)
+    return Result(
+      self, 'GET', request, result_type=Person, concurrency=concurrency,
+      endpoint='people_search'
+    )
 
   def people_search_by_topic(self, \
-      query=None, latitude=None, longitude=None, radius=None):
-    api_endpoint = API_PREFIX + "/activities/search/@people?alt=json"
-    if query:
-      api_endpoint += "&q=" + urllib.quote_plus(query)
-    if (latitude is not None) and (longitude is not None):
-      api_endpoint += "&lat=" + urllib.quote(latitude)
-      api_endpoint += "&lon=" + urllib.quote(longitude)
-    if radius is not None:
-      api_endpoint += "&radius=" + urllib.quote(str(radius))
-    return Result(self, 'GET', api_endpoint, result_type=Person)
+      query=None, latitude=None, longitude=None, radius=None, fields=None):
+    params = self.__read_params(fields) + [('q', query or None)]
+    params += self.__location_params(latitude, longitude, radius)
+    request = _APIRequest('GET', '/activities/search/@people', params=params)
+    return Result(
+      self, 'GET', request, result_type=Person,
+      endpoint='people_search_by_topic'
+    )
 
-  def person(self, user_id='@me'):
+  def person(self, user_id='@me', fields=None):
     if isinstance(user_id, Person):
       # You'd think we could just return directly here, but sometimes a
       # Person object is incomplete, in which case this operation would
       # 'upgrade' to the full Person object.
       user_id = user_id.id
     if self.oauth_access_token:
-      api_endpoint = API_PREFIX + ("/people/%s/@self" % user_id)
-      api_endpoint += "?alt=json"
+      request = _APIRequest(
+        'GET', '/people/%s/@self', (user_id,),
+        params=self.__read_params(fields)
+      )
       return Result(
-        self, 'GET', api_endpoint, result_type=Person, singular=True
+        self, 'GET', request, result_type=Person, singular=True,
+        endpoint='person'
       )
     else:
       raise ValueError("This client doesn't have an authenticated user.")
 
-  def followers(self, user_id='@me'):
+  def _shared_person(self, json, upgrade=False):
+    """
+    Returns a L{Person} for the JSON, reusing the one this client already
+    built for the same id while it's still in use anywhere.  With
+    C{upgrade}, the JSON is a full profile, and it replaces the fields of
+    any existing L{Person} in place.  Otherwise, JSON with fields the
+    existing L{Person} lacks is merged into it.
+    """
+    person_id = isinstance(json, dict) and json.get('id')
+    if person_id and not upgrade:
+      person = self._people.get(person_id)
+      if person is not None and not person._lacks_fields(json):
+        return person
+    person = Person._from_item(json, self)
+    if not person.id:
+      return person
+    self._people_lock.acquire()
+    try:
+      shared = self._people.setdefault(person.id, person)
+      if shared is not person:
+        if upgrade:
+          shared._update(person)
+        elif shared._lacks_fields(json):
+          shared._merge(json)
+    finally:
+      self._people_lock.release()
+    return shared
+
+  def followers(self, user_id='@me', concurrency=DEFAULT_POCO_CONCURRENCY,
+      fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
-    api_endpoint = API_PREFIX + ("/people/%s/@groups/@followers" % user_id)
-    api_endpoint += "?alt=json"
-    return Result(self, 'GET', api_endpoint, result_type=Person)
+    request = _APIRequest(
+      'GET', '/people/%s/@groups/@followers', (user_id,),
+      params=self.__read_params(fields)
+    )
+    return Result(
+      self, 'GET', request, result_type=Person, concurrency=concurrency,
+      endpoint='followers'
+    )
 
-  def following(self, user_id='@me'):
+  def following(self, user_id='@me', concurrency=DEFAULT_POCO_CONCURRENCY,
+      fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
-    api_endpoint = API_PREFIX + ("/people/%s/@groups/@following" % user_id)
-    api_endpoint += "?alt=json"
-    return Result(self, 'GET', api_endpoint, result_type=Person)
+    request = _APIRequest(
+      'GET', '/people/%s/@groups/@following', (user_id,),
+      params=self.__read_params(fields)
+    )
+    return Result(
+      self, 'GET', request, result_type=Person, concurrency=concurrency,
+      endpoint='following'
+    )
 
   def follow(self, user_id):
     if isinstance(user_id, Person):
       user_id = user_id.id
     if self.oauth_access_token:
-      api_endpoint = API_PREFIX + (
-        "/people/@me/@groups/@following/%s" % user_id
+      request = _APIRequest(
+        'PUT', '/people/@me/@groups/@following/%s', (user_id,),
+        params=_JSON_PARAMS
       )
-      api_endpoint += "?alt=json"
-      return Result(self, 'PUT', api_endpoint, result_type=None).data
+      return Result(self, 'PUT', request, result_type=None).data
     else:
       raise ValueError("This client doesn't have an authenticated user.")
 
@@ -643,168 +2376,181 @@ class Client:
     if isinstance(user_id, Person):
       user_id = user_id.id
     if self.oauth_access_token:
-      api_endpoint = API_PREFIX + (
-        "/people/@me/@groups/@following/%s" % user_id
+      request = _APIRequest(
+        'DELETE', '/people/@me/@groups/@following/%s', (user_id,),
+        params=_JSON_PARAMS
       )
-      api_endpoint += "?alt=json"
-      return Result(self, 'DELETE', api_endpoint, result_type=None).data
+      return Result(self, 'DELETE', request, result_type=None).data
     else:
       raise ValueError("This client doesn't have an authenticated user.")
 
   # Post APIs
 
   def search(self, query=None, latitude=None, longitude=None, radius=None,
-      max_results=20):
-    api_endpoint = API_PREFIX + "/activities/search?alt=json"
-    if query:
-      api_endpoint += "&q=" + urllib.quote_plus(query)
+      max_results=20, fields=None):
+    params = self.__read_params(fields, max_results) + [('q', query or None)]
+    params += self.__location_params(latitude, longitude, radius)
+    request = _APIRequest('GET', '/activities/search', params=params)
+    return Result(
+      self, 'GET', request, result_type=Post, endpoint='search'
+    )
+
+  def __location_params(self, latitude, longitude, radius):
+    params = []
     if (latitude is not None) and (longitude is not None):
-      api_endpoint += "&lat=" + urllib.quote(latitude)
-      api_endpoint += "&lon=" + urllib.quote(longitude)
+      params.append(('lat', latitude))
+      params.append(('lon', longitude))
     if radius is not None:
-      api_endpoint += "&radius=" + urllib.quote(str(radius))
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Post)
-
-  def __add_max_results(self, api_endpoint, max_results):
-    if max_results:
-      api_endpoint += "&max-results=" + str(max_results)
-      return api_endpoint
-
-    return api_endpoint
+      params.append(('radius', radius))
+    return params
 
-  def __add_max_comments(self, api_endpoint, max_comments):
-    if max_comments:
-      api_endpoint += "&max-comments=" + str(max_comments)
-      return api_endpoint
+  def __read_params(self, fields, max_results=None):
+    return list(_JSON_PARAMS) + [
+      ('fields', fields), ('max-results', max_results or None)
+    ]
 
-    return api_endpoint
-
-  def posts(self, type_id='@self', user_id='@me', max_results=20, max_comments=0):
+  def posts(self, type_id='@self', user_id='@me', max_results=20, max_comments=0,
+      fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
-    api_endpoint = API_PREFIX + "/activities/" + str(user_id) + "/" + type_id
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    api_endpoint = self.__add_max_comments(api_endpoint, max_comments)
-    return Result(self, 'GET', api_endpoint, result_type=Post)
+    params = self.__read_params(fields, max_results)
+    params.append(('max-comments', max_comments or None))
+    request = _APIRequest(
+      'GET', '/activities/%s/%s', (user_id, type_id), params=params
+    )
+    return Result(
+      self, 'GET', request, result_type=Post, endpoint='posts'
+    )
 
-  def post(self, post_id, actor_id='0'):
+  def post(self, post_id, actor_id='0', fields=None):
     if isinstance(actor_id, Person):
       actor_id = actor_id.id
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/" + str(actor_id) + \
-      "/@self/" + post_id
-    api_endpoint += "?alt=json"
-    return Result(self, 'GET', api_endpoint, result_type=Post, singular=True)
+    request = _APIRequest(
+      'GET', '/activities/%s/@self/%s', (actor_id, post_id),
+      params=self.__read_params(fields)
+    )
+    return Result(
+      self, 'GET', request, result_type=Post, singular=True,
+      endpoint='post'
+    )
 
   def create_post(self, post):
-    api_endpoint = API_PREFIX + "/activities/@me/@self"
-    api_endpoint += "?alt=json"
-    json_string = simplejson.dumps({'data': post._json_output})
+    json_string = JSON_BACKEND.encode({'data': post._json_output})
     logging.debug('Creating post: %s' % json_string)
-
-    return Result(
-      self, 'POST', api_endpoint, http_body=json_string, result_type=None
-    ).data
+    request = _APIRequest(
+      'POST', '/activities/@me/@self', params=_JSON_PARAMS,
+      http_body=json_string
+    )
+    return Result(self, 'POST', request, result_type=None).data
 
   def update_post(self, post):
     if not post.id:
       raise ValueError('Post must have a valid id to update.')
-    api_endpoint = API_PREFIX + "/activities/@me/@self/" + post.id
-    api_endpoint += "?alt=json"
-    json_string = simplejson.dumps({'data': post._json_output})
-    return Result(
-      self, 'PUT', api_endpoint, http_body=json_string, result_type=None
-    ).data
+    json_string = JSON_BACKEND.encode({'data': post._json_output})
+    request = _APIRequest(
+      'PUT', '/activities/@me/@self/%s', (post.id,), params=_JSON_PARAMS,
+      http_body=json_string
+    )
+    return Result(self, 'PUT', request, result_type=None).data
 
   def delete_post(self, post):
     if not post.id:
       raise ValueError('Post must have a valid id to delete.')
-    api_endpoint = API_PREFIX + "/activities/@me/@self/" + post.id
-    api_endpoint += "?alt=json"
-    return Result(self, 'DELETE', api_endpoint, result_type=None).data
+    request = _APIRequest(
+      'DELETE', '/activities/@me/@self/%s', (post.id,), params=_JSON_PARAMS
+    )
+    return Result(self, 'DELETE', request, result_type=None).data
 
-  def comments(self, post_id, actor_id='0', max_results=20):
+  def comments(self, post_id, actor_id='0', max_results=20, fields=None):
     if isinstance(actor_id, Person):
       actor_id = actor_id.id
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/" + actor_id + \
-      "/@self/" + post_id + "/@comments"
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Comment)
+    request = _APIRequest(
+      'GET', '/activities/%s/@self/%s/@comments', (actor_id, post_id),
+      params=self.__read_params(fields, max_results)
+    )
+    return Result(
+      self, 'GET', request, result_type=Comment, endpoint='comments'
+    )
 
   def create_comment(self, comment):
-    api_endpoint = API_PREFIX + ("/activities/%s/@self/%s/@comments" % (
-      comment.post(client=self).actor.id,
-      comment.post(client=self).id
-    ))
-    api_endpoint += "?alt=json"
-    json_string = simplejson.dumps({'data': comment._json_output})
-    return Result(
-      self, 'POST', api_endpoint, http_body=json_string, result_type=None
-    ).data
+    json_string = JSON_BACKEND.encode({'data': comment._json_output})
+    request = _APIRequest(
+      'POST', '/activities/%s/@self/%s/@comments', (
+        comment.post(client=self).actor.id,
+        comment.post(client=self).id
+      ),
+      params=_JSON_PARAMS, http_body=json_string
+    )
+    return Result(self, 'POST', request, result_type=None).data
 
   def update_comment(self, comment):
     if not comment.id:
       raise ValueError('Comment must have a valid id to update.')
-    api_endpoint = API_PREFIX + ("/activities/%s/@self/%s/@comments/%s" % (
-      comment.actor.id,
-      comment.post(client=self).id,
-      comment.id
-    ))
-    api_endpoint += "?alt=json"
-    json_string = simplejson.dumps({'data': comment._json_output})
-    return Result(
-      self, 'PUT', api_endpoint, http_body=json_string, result_type=None
-    ).data
+    json_string = JSON_BACKEND.encode({'data': comment._json_output})
+    request = _APIRequest(
+      'PUT', '/activities/%s/@self/%s/@comments/%s', (
+        comment.actor.id,
+        comment.post(client=self).id,
+        comment.id
+      ),
+      params=_JSON_PARAMS, http_body=json_string
+    )
+    return Result(self, 'PUT', request, result_type=None).data
 
   def delete_comment(self, comment):
     if not comment.id:
       raise ValueError('Comment must have a valid id to update.')
-    api_endpoint = API_PREFIX + ("/activities/%s/@self/%s/@comments/%s" % (
-      comment.actor.id,
-      comment.post(client=self).id,
-      comment.id
-    ))
-    api_endpoint += "?alt=json"
-    return Result(self, 'DELETE', api_endpoint, result_type=None).data
-
-  def commented_posts(self, user_id='@me'):
+    request = _APIRequest(
+      'DELETE', '/activities/%s/@self/%s/@comments/%s', (
+        comment.actor.id,
+        comment.post(client=self).id,
+        comment.id
+      ),
+      params=_JSON_PARAMS
+    )
+    return Result(self, 'DELETE', request, result_type=None).data
+
+  def commented_posts(self, user_id='@me', fields=None):
     """Returns a collection of posts that the user has commented on."""
-    return self.posts(type_id='@comments', user_id=user_id)
+    return self.posts(type_id='@comments', user_id=user_id, fields=fields)
   
   # Related Links
   
-  def related_links(self, post_id, actor_id='0'):
+  def related_links(self, post_id, actor_id='0', fields=None):
     if isinstance(actor_id, Person):
       actor_id = actor_id.id
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/" + actor_id + \
-      "/@self/" + post_id + "/@related"
-    api_endpoint += "?alt=json"
-    return Result(self, 'GET', api_endpoint, result_type=Link)
+    request = _APIRequest(
+      'GET', '/activities/%s/@self/%s/@related', (actor_id, post_id),
+      params=self.__read_params(fields)
+    )
+    return Result(
+      self, 'GET', request, result_type=Link, endpoint='related_links'
+    )
 
   # Likes
 
-  def likers(self, post_id, actor_id='0', max_results=20):
+  def likers(self, post_id, actor_id='0', max_results=20, fields=None):
     if isinstance(actor_id, Person):
       actor_id = actor_id.id
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/" + actor_id + \
-      "/@self/" + post_id + "/@liked"
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Person)
+    request = _APIRequest(
+      'GET', '/activities/%s/@self/%s/@liked', (actor_id, post_id),
+      params=self.__read_params(fields, max_results)
+    )
+    return Result(
+      self, 'GET', request, result_type=Person, endpoint='likers'
+    )
 
-  def liked_posts(self, user_id='@me'):
+  def liked_posts(self, user_id='@me', fields=None):
     """Returns a collection of posts that a user has liked."""
-    return self.posts(type_id='@liked', user_id=user_id)
+    return self.posts(type_id='@liked', user_id=user_id, fields=fields)
 
   def like_post(self, post_id):
     """
@@ -812,10 +2558,11 @@ class Client:
     """
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/@me/@liked/" + post_id
-    api_endpoint += "?alt=json"
+    request = _APIRequest(
+      'PUT', '/activities/@me/@liked/%s', (post_id,), params=_JSON_PARAMS
+    )
     return Result(
-      self, 'PUT', api_endpoint, result_type=None, singular=True
+      self, 'PUT', request, result_type=None, singular=True
     ).data
 
   def unlike_post(self, post_id):
@@ -824,10 +2571,11 @@ class Client:
     """
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/@me/@liked/" + post_id
-    api_endpoint += "?alt=json"
+    request = _APIRequest(
+      'DELETE', '/activities/@me/@liked/%s', (post_id,), params=_JSON_PARAMS
+    )
     return Result(
-      self, 'DELETE', api_endpoint, result_type=None, singular=True
+      self, 'DELETE', request, result_type=None, singular=True
     ).data
 
   # Mutes
@@ -838,10 +2586,11 @@ class Client:
     """
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/@me/@muted/" + post_id
-    api_endpoint += "?alt=json"
+    request = _APIRequest(
+      'PUT', '/activities/@me/@muted/%s', (post_id,), params=_JSON_PARAMS
+    )
     return Result(
-      self, 'PUT', api_endpoint, result_type=None, singular=True
+      self, 'PUT', request, result_type=None, singular=True
     ).data
 
   def unmute_post(self, post_id):
@@ -850,20 +2599,23 @@ class Client:
     """
     if isinstance(post_id, Post):
       post_id = post_id.id
-    api_endpoint = API_PREFIX + "/activities/@me/@muted/" + post_id
-    api_endpoint += "?alt=json"
+    request = _APIRequest(
+      'DELETE', '/activities/@me/@muted/%s', (post_id,), params=_JSON_PARAMS
+    )
     return Result(
-      self, 'DELETE', api_endpoint, result_type=None, singular=True
+      self, 'DELETE', request, result_type=None, singular=True
     ).data
 
   def share_count(self, uri):
     """
     Returns information about the number of times a URI has been shared.
     """
-    api_endpoint = API_PREFIX + "/activities/count?alt=json"
-    api_endpoint += "&url=" + urllib.quote(uri)
+    request = _APIRequest(
+      'GET', '/activities/count', params=_JSON_PARAMS + (('url', uri),)
+    )
     result = Result(
-      self, 'GET', api_endpoint, result_type=None, singular=True
+      self, 'GET', request, result_type=None, singular=True,
+      endpoint='share_count'
     )
     result.data
     json = result._json
@@ -874,53 +2626,106 @@ class Client:
       return int(json['counts'][uri][0]['count'])
     except KeyError, e:
       raise JSONParseError(
-        uri=api_endpoint,
+        uri=request.uri,
         json=json,
         exception=e
       )
 
   # Albums
 
-  def albums(self, user_id='@me', max_results=20):
+  def albums(self, user_id='@me', max_results=20, fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
-    api_endpoint = API_PREFIX + "/photos/" + str(user_id) + "/@self"
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Album)
+    request = _APIRequest(
+      'GET', '/photos/%s/@self', (user_id,),
+      params=self.__read_params(fields, max_results)
+    )
+    return Result(
+      self, 'GET', request, result_type=Album, endpoint='albums'
+    )
 
-  def album(self, user_id='@me', album_id=None, max_results=20):
+  def album(self, user_id='@me', album_id=None, max_results=20,
+      fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
-    api_endpoint = API_PREFIX + "/photos/" + str(user_id) + \
-      "/@self/" + album_id
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Album, singular=True)
+    request = _APIRequest(
+      'GET', '/photos/%s/@self/%s', (user_id, album_id),
+      params=self.__read_params(fields, max_results)
+    )
+    return Result(
+      self, 'GET', request, result_type=Album, singular=True,
+      endpoint='album'
+    )
 
-  def photos(self, user_id='@me', album_id='@recent', max_results=20):
+  def photos(self, user_id='@me', album_id='@recent', max_results=20,
+      fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
     if isinstance(album_id, Album):
       album_id = album_id.id
-    api_endpoint = API_PREFIX + "/photos/" + str(user_id) + \
-      "/@self/" + album_id + "/@photos"
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Photo)
+    request = _APIRequest(
+      'GET', '/photos/%s/@self/%s/@photos', (user_id, album_id),
+      params=self.__read_params(fields, max_results)
+    )
+    return Result(
+      self, 'GET', request, result_type=Photo, endpoint='photos'
+    )
 
-  def photo(self, user_id='@me', album_id=None, photo_id=None, max_results=20):
+  def photo(self, user_id='@me', album_id=None, photo_id=None, max_results=20,
+      fields=None):
     if isinstance(user_id, Person):
       user_id = user_id.id
     if isinstance(album_id, Album):
       album_id = album_id.id
     if isinstance(photo_id, Photo):
       photo_id = photo_id.id
-    api_endpoint = API_PREFIX + "/photos/" + str(user_id) + \
-      "/@self/" + album_id + "/@photos/" + photo_id
-    api_endpoint += "?alt=json"
-    api_endpoint = self.__add_max_results(api_endpoint, max_results)
-    return Result(self, 'GET', api_endpoint, result_type=Photo, singular=True)
+    request = _APIRequest(
+      'GET', '/photos/%s/@self/%s/@photos/%s', (user_id, album_id, photo_id),
+      params=self.__read_params(fields, max_results)
+    )
+    return Result(
+      self, 'GET', request, result_type=Photo, singular=True,
+      endpoint='photo'
+    )
+
+  # Batches
+
+  def map_fetch(self, function, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Calls C{function(item)} for every item at once on a pool of worker
+    threads, and waits for them all to finish.  Calls that return a
+    L{Result} have its first page loaded on the worker thread too.
+
+    Returns a finished L{Future} for each item, in the same order as
+    C{items}.  A call that fails only affects its own L{Future}, whose
+    C{exception()} gives the error and whose C{result()} raises it.
+
+    @type function: callable
+    @param function: Usually an endpoint method, e.g. C{client.person}.
+    @type items: list
+    @param items: The argument for each call.
+    @type max_workers: int
+    @param max_workers: The maximum number of calls in flight at once.
+    """
+    workers = WorkerPool(max_workers)
+    try:
+      futures = [
+        workers.submit(_fetch_item, function, item) for item in items
+      ]
+      for future in futures:
+        # Waits without raising the call's exception
+        future.exception()
+    finally:
+      workers.shutdown(cancel=True)
+    return futures
+
+  def batch(self, max_workers=DEFAULT_MAX_WORKERS, multipart=False):
+    """
+    Returns a L{Batch} that collects calls to this client's endpoints, so
+    that they can all be made at once.  With C{multipart}, they're sent
+    together in as few HTTP requests as possible.
+    """
+    return Batch(self, max_workers=max_workers, multipart=multipart)
 
   # OAuth debugging
 
@@ -940,127 +2745,616 @@ class Client:
     )
     return response.read()
 
-class Post:
+def _asynchronous(name):
+  def call(self, *args, **kwargs):
+    return self.workers.submit(self._call, name, args, kwargs)
+  call.__name__ = name
+  call.__doc__ = \
+    'Calls L{Client.%s} in the background and returns a L{Future}.' % name
+  return call
+
+class AsyncClient:
+  """
+  The L{AsyncClient} object offers the same endpoints as a L{Client}, but
+  none of them block.  Each call runs on a pool of worker threads and returns
+  a L{Future} straight away, so a single thread can keep many requests in
+  flight.  Calls that would return a L{Result} resolve to that L{Result}
+  with its first page already loaded.  Everything else, such as the OAuth
+  setup methods, is passed straight through to the wrapped L{Client}.
+  """
+  def __init__(self, client=None, max_workers=DEFAULT_ASYNC_WORKERS,
+      share_connections=True):
+    """
+    @type client: L{Client}
+    @param client: The client to make calls with.  By default a new one is
+      created.
+    @type max_workers: int
+    @param max_workers: The maximum number of calls in flight at once.
+    @type share_connections: bool
+    @param share_connections: When no client is given, whether the new one
+      uses the process-wide L{SHARED_CONNECTION_POOL}, or a pool private to
+      it with enough connections for every worker.
+    """
+    if not client:
+      if share_connections:
+        client = Client()
+      else:
+        client = Client(
+          connection_pool=ConnectionPool(max_connections=max_workers)
+        )
+    self.client = client
+    self.workers = WorkerPool(max_workers)
+
+  def __getattr__(self, name):
+    return getattr(self.client, name)
+
+  def _call(self, name, args, kwargs):
+    value = getattr(self.client, name)(*args, **kwargs)
+    if isinstance(value, Result):
+      # Load the first page here rather than on the caller's thread
+      value.data
+    return value
+
+  def _next_page(self, result):
+    if not result.next_uri:
+      return None
+    result.load_next()
+    result.data
+    return result
+
+  def next_page(self, result):
+    """
+    Moves a L{Result} on to its next page in the background.  The returned
+    L{Future} resolves to the same L{Result}, or to C{None} once there are no
+    more pages.  The L{Result} must not be used until the L{Future} is done.
+    """
+    return self.workers.submit(self._next_page, result)
+
+  def close(self):
+    """Lets the worker threads exit once the calls in flight are done."""
+    self.workers.shutdown()
+
+# The Client methods that call the API
+_ENDPOINTS = (
+  'people_search', 'people_search_by_topic', 'person', 'followers',
+  'following', 'follow', 'unfollow', 'search', 'posts', 'post',
+  'create_post', 'update_post', 'delete_post', 'comments', 'create_comment',
+  'update_comment', 'delete_comment', 'commented_posts', 'related_links',
+  'likers', 'liked_posts', 'like_post', 'unlike_post', 'mute_post',
+  'unmute_post', 'share_count', 'albums', 'album', 'photos', 'photo'
+)
+
+for _name in ('fetch_oauth_request_token', 'fetch_oauth_access_token') + \
+    _ENDPOINTS + ('oauth_token_info',):
+  setattr(AsyncClient, _name, _asynchronous(_name))
+del _name
+
+def _fetch_item(function, item):
+  value = function(item)
+  if isinstance(value, Result):
+    # Load the first page here rather than on the caller's thread
+    value.data
+  return value
+
+def _batched(name):
+  def call(self, *args, **kwargs):
+    self.calls.append((name, args, kwargs))
+    return len(self.calls) - 1
+  call.__name__ = name
+  call.__doc__ = \
+    'Adds a call to L{Client.%s} to the batch and returns its index.' % name
+  return call
+
+class _BatchedRequest(Exception):
+  """Stops a call in a multipart L{Batch} at the request it would send."""
+  def __init__(self, request, http_headers):
+    Exception.__init__(self, 'Request was batched')
+    self.request = request
+    self.http_headers = http_headers
+
+def _default_batch_uri():
+  scheme, netloc = urlparse.urlsplit(API_PREFIX)[:2]
+  return '%s://%s%s' % (scheme, netloc, BATCH_PATH)
+
+def _encode_multipart(parts, boundary):
+  """
+  Packs C{(content_id, request, http_headers)} parts into the body of a
+  C{multipart/mixed} batch request, with each part as an C{application/http}
+  message.
+  """
+  lines = []
+  for content_id, request, http_headers in parts:
+    uri = urlparse.urlsplit(request.uri)
+    path = uri.path
+    if uri.query:
+      path += '?' + uri.query
+    lines.extend([
+      '--' + boundary,
+      'Content-Type: application/http',
+      'Content-ID: <%s>' % content_id,
+      '',
+      '%s %s HTTP/1.1' % (request.http_method, path)
+    ])
+    for name, value in http_headers.items():
+      lines.append('%s: %s' % (name, value))
+    if request.http_body:
+      lines.append('Content-Type: application/json')
+      lines.append('Content-Length: %d' % len(request.http_body))
+    lines.extend(['', request.http_body])
+  lines.append('--' + boundary + '--')
+  return '\r\n'.join(lines)
+
+_BLANK_LINE = re.compile('\r?\n\r?\n')
+
+def _parse_headers(lines):
+  headers = {}
+  for line in lines:
+    if ':' in line:
+      name, value = line.split(':', 1)
+      headers[name.strip().lower()] = value.strip()
+  return headers
+
+def _split_head(text):
+  match = _BLANK_LINE.search(text)
+  if not match:
+    return text.splitlines(), ''
+  return text[:match.start()].splitlines(), text[match.end():]
+
+def _decode_multipart(body, boundary):
+  """
+  Splits the body of a C{multipart/mixed} batch response into a C{dict} of
+  L{_BufferedResponse}s, keyed by the C{Content-ID} of each part.
+  """
+  responses = {}
+  delimiter = re.compile('(?:^|\r?\n)--' + re.escape(boundary))
+  for part in delimiter.split(body)[1:]:
+    if part.startswith('--'):
+      # The closing delimiter
+      break
+    head, message = _split_head(part.lstrip('\r\n'))
+    content_id = _parse_headers(head).get('content-id', '').strip('<>')
+    head, message_body = _split_head(message)
+    if not head:
+      continue
+    status_line = head[0].split(' ', 2) + ['']
+    headers = _parse_headers(head[1:])
+    if headers.get('content-length'):
+      message_body = message_body[:int(headers['content-length'])]
+    responses[content_id] = _BufferedResponse(
+      int(status_line[1]), status_line[2], headers, message_body
+    )
+  return responses
+
+class Batch:
+  """
+  The L{Batch} object collects calls to the endpoints of a L{Client}, then
+  makes them all at once on a pool of worker threads with L{execute}.  Each
+  endpoint method returns the position its outcome will have in the list
+  that L{execute} returns.  With enough workers, a batch takes about as long
+  as its slowest call, rather than as long as all of its calls put together::
+    batch = client.batch()
+    for post_id in post_ids:
+      batch.likers(post_id)
+    for future in batch.execute():
+      if not future.exception():
+        print len(future.result().data)
+
+  A C{multipart} batch instead sends its calls in a single signed
+  C{multipart/mixed} request to the API's batch endpoint, up to
+  L{MAX_BATCH_PARTS} at a time, and splits the response back up between
+  them.  Only the first request each call makes goes in the batch; anything
+  else it needs, such as later pages, is fetched as usual.
+  """
+  def __init__(self, client, max_workers=DEFAULT_MAX_WORKERS,
+      multipart=False, batch_uri=None):
+    """
+    @type client: L{Client}
+    @param client: The client to make calls with.
+    @type max_workers: int
+    @param max_workers: The maximum number of calls in flight at once.
+    @type multipart: bool
+    @param multipart: Whether to send the calls in C{multipart/mixed}
+      requests rather than one request each.
+    @type batch_uri: string
+    @param batch_uri: Where to send C{multipart} batches.  Defaults to
+      L{BATCH_PATH} on the host in L{API_PREFIX}.
+    """
+    self.client = client
+    self.max_workers = max_workers
+    self.multipart = multipart
+    self.batch_uri = batch_uri
+    self.calls = []
+
+  def __len__(self):
+    return len(self.calls)
+
+  def _call(self, call):
+    name, args, kwargs = call
+    return getattr(self.client, name)(*args, **kwargs)
+
+  def execute(self):
+    """
+    Makes every call in the batch, and returns a finished L{Future} for each
+    of them, in the order they were added.  See L{Client.map_fetch}.
+    """
+    calls, self.calls = self.calls, []
+    if self.multipart:
+      futures = []
+      for start in range(0, len(calls), MAX_BATCH_PARTS):
+        futures.extend(
+          self._execute_multipart(calls[start:start + MAX_BATCH_PARTS])
+        )
+      return futures
+    return self.client.map_fetch(
+      self._call, calls, max_workers=self.max_workers
+    )
+
+  def _part_client(self, fetch_api_response):
+    """
+    Returns a copy of the client which makes its requests with
+    C{fetch_api_response} instead.
+    """
+    part_client = copy.copy(self.client)
+    part_client.fetch_api_response = fetch_api_response
+    # Its requests mustn't be shared with anyone else's
+    part_client.single_flight = None
+    return part_client
+
+  def _run(self, client, call):
+    name, args, kwargs = call
+    value = getattr(client, name)(*args, **kwargs)
+    if isinstance(value, Result):
+      value.data
+      value.client = self.client
+    return value
+
+  def _execute_multipart(self, calls):
+    futures = [Future() for call in calls]
+    # Run each call until it tries to send its first request
+    parts = []
+    def capture(http_method, http_uri, http_headers={}, http_connection=None,
+        http_body=''):
+      if not isinstance(http_uri, _APIRequest):
+        http_uri = _APIRequest.from_uri(http_method, http_uri, http_body)
+      raise _BatchedRequest(http_uri, dict(http_headers))
+    capturing_client = self._part_client(capture)
+    for i in range(len(calls)):
+      try:
+        value = self._run(capturing_client, calls[i])
+      except _BatchedRequest, e:
+        request = e.request
+        if self.client.api_key:
+          request = request.with_param('key', self.client.api_key, first=True)
+        parts.append(('item%d' % i, request, e.http_headers, i))
+      except Exception:
+        futures[i]._finish(exc_info=sys.exc_info())
+      else:
+        # Nothing needed fetching, e.g. it was already cached
+        futures[i]._finish(value=value)
+    if not parts:
+      return futures
+    try:
+      responses = self._send_multipart(parts)
+    except Exception:
+      exc_info = sys.exc_info()
+      for part in parts:
+        futures[part[3]]._finish(exc_info=exc_info)
+      return futures
+    # Run each call again, handing it its part of the response
+    for content_id, request, http_headers, i in parts:
+      pending = [responses.get('response-' + content_id)]
+      def replay(http_method, http_uri, http_headers={}, http_connection=None,
+          http_body=''):
+        if pending:
+          response = pending.pop()
+          if response is None:
+            raise RetrieveError(
+              uri=request.uri, message='Missing from the batch response'
+            )
+          return response
+        return self.client.fetch_api_response(
+          http_method, http_uri, http_headers=http_headers,
+          http_connection=http_connection, http_body=http_body
+        )
+      try:
+        value = self._run(self._part_client(replay), calls[i])
+      except Exception:
+        futures[i]._finish(exc_info=sys.exc_info())
+      else:
+        futures[i]._finish(value=value)
+    return futures
+
+  def _send_multipart(self, parts):
+    parts = [part[:3] for part in parts]
+    # The boundary comes from the parts, so the same batch always has the
+    # same body, e.g. for a Cassette to match it
+    boundary = 'batch_%08x' % (
+      zlib.crc32(_encode_multipart(parts, 'batch')) & 0xffffffff
+    )
+    batch_uri = self.batch_uri or _default_batch_uri()
+    response = self.client.fetch_api_response(
+      'POST', batch_uri,
+      http_headers={
+        'Content-Type': 'multipart/mixed; boundary=%s' % boundary
+      },
+      http_body=_encode_multipart(parts, boundary)
+    )
+    body = response.read()
+    if not (response.status >= 200 and response.status < 300):
+      message = 'Batch request failed with status %d' % response.status
+      try:
+        json = JSON_BACKEND.decode(body)
+        message = json['error'].get('message') or message
+      except Exception:
+        json = None
+      raise RetrieveError(uri=batch_uri, message=message, json=json)
+    content_type, options = cgi.parse_header(
+      response.getheader('Content-Type', '')
+    )
+    if content_type != 'multipart/mixed' or not options.get('boundary'):
+      raise RetrieveError(
+        uri=batch_uri,
+        message='Expected a multipart/mixed response, not %s' % content_type
+      )
+    return _decode_multipart(body, options['boundary'])
+
+for _name in _ENDPOINTS:
+  setattr(Batch, _name, _batched(_name))
+del _name
+
+def _lazy_slots(*names):
+  """Returns the private slots that hold the values of L{_LazyAttribute}s."""
+  return tuple(['_lazy_' + name for name in names])
+
+class _LazyAttribute(object):
+  """
+  A model attribute which is decoded from the JSON the model was built from
+  the first time it is read, and then kept in a private slot.  Models keep
+  that JSON, already pruned, in C{_source}; the attribute is C{None} for
+  models that weren't built from JSON.  Assigning to the attribute replaces
+  it without decoding anything.
+  """
+  def __init__(self, decode, name=None):
+    self.decode = decode
+    self.name = name or decode.__name__
+    self.slot = _lazy_slots(self.name)[0]
+    self.__doc__ = decode.__doc__
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      return self
+    try:
+      return getattr(instance, self.slot)
+    except AttributeError:
+      pass
+    json = instance._source
+    value = None
+    if json is not None:
+      try:
+        value = self.decode(instance, json)
+      except KeyError, e:
+        raise JSONParseError(
+          json=json,
+          exception=e
+        )
+    setattr(instance, self.slot, value)
+    return value
+
+  def __set__(self, instance, value):
+    setattr(instance, self.slot, value)
+
+def _lazy_field(name, keys, convert=None):
+  """Returns a L{_LazyAttribute} which is read from the JSON by a field spec."""
+  read = _field_reader(keys, convert)
+  def decode(model, json):
+    return read(json)
+  return _LazyAttribute(decode, name)
+
+def _person(json, client, shared=True):
+  """
+  Helper for building the L{Person} behind an actor or owner, shared with the
+  other objects the client has built for that person unless C{shared} is
+  false.
+  """
+  if client and shared:
+    return client._shared_person(json)
+  if client:
+    return Person._from_item(json, client)
+  return Person(json)
+
+def _release_json(model):
+  """
+  Decodes every field of a model, and of the models within it, and then lets
+  go of the JSON they were decoded from.
+  """
+  slots = getattr(type(model), '__slots__', ())
+  if 'json' not in slots:
+    return
+  for name in getattr(model, '_lazy_attributes', ()):
+    getattr(model, name)
+  for name in slots:
+    value = getattr(model, name, None)
+    if isinstance(value, list):
+      for item in value:
+        _release_json(item)
+    else:
+      _release_json(value)
+  model.json = None
+  if '_source' in slots:
+    model._source = None
+
+class Post(object):
   """
   The L{Post} object represents a post within Buzz.  A post has an actor and
   content, and may have zero or more comments and likes.  An L{Attachment} may
   be associated with the post by appending to the attachments list.
   """
+  _lazy_attributes = (
+    'content', 'annotation', 'title', 'object', 'links', 'link', 'uri',
+    'replies', 'liked', 'comment_count', 'liker_count', 'verb', 'published',
+    'updated', 'type', 'actor', 'attachments', 'geocode', 'place_name',
+    'visibility', 'source'
+  )
+  __slots__ = (
+    'client', 'json', '_source', '_projected', 'id', 'place_id', '_likers',
+    '_comments'
+  ) + _lazy_slots(*_lazy_attributes)
+
   def __init__(self, json=None, client=None,
       content=None, annotation=None, uri=None, verb=None, actor=None,
       geocode=None, place_id=None,
       attachments=None):
     self.client = client
     self.json = json
-    self.id = None
-    self.object = None
-    self.type=None
-    self.place_name=None
-    self.visibility=None
-    self.published=None
-    self.updated=None
-    self.source=None
-    
-    # Construct the post piece-wise.
-    self.content = content
-    self.annotation = annotation
-    self.uri = uri
-    self.verb = verb
-    self.actor = actor
-    self.geocode = geocode
+    self._source = None
+    self._projected = False
     self.place_id = place_id
-    self.attachments = attachments
-    
     self._likers = None
-    self.liker_count = 0
     self._comments = None
-    self.comment_count = 0
-    
-    if self.json:
-      # Parse the incoming JSON
+
+    if json:
       # Follow Postel's law
-      try:
-        json = _prune_json_envelope(json)
-        if json.get('error'):
-          raise JSONParseError(json=json)
-        self.id = json['id']
-        if isinstance(json.get('content'), dict):
-          self.content = json['content']['value']
-        elif json.get('content'):
-          self.content = json['content']
-        elif json.get('object') and json['object'].get('content'):
-          self.content = json['object']['content']
-        if json.get('annotation'):
-          self.annotation = json['annotation']
-        if isinstance(json['title'], dict):
-          self.title = json['title']['value']
-        else:
-          self.title = json['title']
-        if json.get('object'):
-          self.object = json['object']
-        if json.get('links'):
-          self.links = _parse_links(json.get('links'))
-        self.replies = []
-        self.liked = []
-        if self.links:
-          for link in self.links:
-            if link.rel == "alternate":
-              self.link = link
-              self.uri = self.link.uri
-            elif link.rel == "replies":
-              self.replies.append(link)
-            elif link.rel == "liked":
-              self.liked.append(link)
-        if self.replies:
-          for reply in self.replies:
-            if reply.count:
-              self.comment_count += reply.count
-        if self.liked:
-          for liker in self.liked:
-            if liker.count:
-              self.liker_count += liker.count
-        if isinstance(json.get('verb'), list):
-          self.verb = json['verb'][0]
-        elif json.get('verb'):
-          self.verb = json['verb']
-        if json.get('published'):
-          self.published = json['published']
-        if json.get('updated'):
-          self.updated = json['updated']
-        if isinstance(json.get('type'), list):
-          self.type = json['type'][0]
-        elif json.get('type'):
-          self.type = json['type']
-        elif self.object and self.object.get('type'):
-          self.type = self.object['type']
-        if json.get('author'):
-          self.actor = Person(json['author'], client=self.client)
-        elif json.get('actor'):
-          self.actor = Person(json['actor'], client=self.client)
-        if self.object and self.object.get('attachments'):
-          self.attachments = [
-            Attachment(attachment_json, client=self.client)
-            for attachment_json
-            in self.object['attachments']
-          ]
-        else:
-          self.attachments = []
-        if json.get('geocode'):
-          self.geocode = _parse_geocode(json['geocode'])
-        if json.get('placeName'):
-          self.place_name = json['placeName']
-        if json.get('visibility'):
-          self.visibility = json['visibility']
-          if isinstance(self.visibility, dict) and \
-              self.visibility.get('entries'):
-            self.visibility = self.visibility.get('entries')
-        if json.get('source') and json['source'].get('title'):
-          self.source = json['source']['title']
-      except KeyError, e:
-        raise JSONParseError(
-          json=json,
-          exception=e
-        )
+      self._set_item(_prune_json_envelope(json))
+    else:
+      self.id = None
+      self.liker_count = 0
+      self.comment_count = 0
+
+    # Construct the post piece-wise.  Anything given explicitly wins over
+    # the JSON.
+    pieces = {
+      'content': content, 'annotation': annotation, 'uri': uri,
+      'verb': verb, 'actor': actor, 'geocode': geocode,
+      'attachments': attachments
+    }
+    for name, value in pieces.items():
+      if value is not None or not json:
+        setattr(self, name, value)
+
+  @classmethod
+  def _from_item(cls, json, client=None, projected=False):
+    """
+    Builds a L{Post} from the JSON for one item of an already pruned page.
+    With C{projected}, the page was fetched with C{fields}, so its actor is
+    kept apart from the people shared by the client.
+    """
+    post = cls.__new__(cls)
+    post.client = client
+    post.json = json
+    post._projected = projected
+    post.place_id = None
+    post._likers = None
+    post._comments = None
+    post._set_item(json)
+    return post
+
+  def _set_item(self, json):
+    if json.get('error'):
+      raise JSONParseError(json=json)
+    # Even the id may have been left out by a field projection
+    self.id = json.get('id')
+    # Everything else is decoded from the JSON when it's first read
+    self._source = json
+
+  @_LazyAttribute
+  def content(self, json):
+    if json.get('content'):
+      return _text(json['content'])
+    elif json.get('object') and json['object'].get('content'):
+      return json['object']['content']
+    return None
+
+  annotation = _lazy_field('annotation', 'annotation')
+
+  @_LazyAttribute
+  def title(self, json):
+    if json.get('title'):
+      return _text(json['title'])
+    return None
+
+  object = _lazy_field('object', 'object')
+
+  @_LazyAttribute
+  def links(self, json):
+    if json.get('links'):
+      return _parse_links(json.get('links'))
+    return []
+
+  @_LazyAttribute
+  def link(self, json):
+    alternate = None
+    for link in self.links:
+      if link.rel == "alternate":
+        alternate = link
+    return alternate
+
+  @_LazyAttribute
+  def uri(self, json):
+    if self.link:
+      return self.link.uri
+    return None
+
+  @_LazyAttribute
+  def replies(self, json):
+    return [link for link in self.links if link.rel == "replies"]
+
+  @_LazyAttribute
+  def liked(self, json):
+    return [link for link in self.links if link.rel == "liked"]
+
+  @_LazyAttribute
+  def comment_count(self, json):
+    return sum([reply.count for reply in self.replies if reply.count])
+
+  @_LazyAttribute
+  def liker_count(self, json):
+    return sum([liker.count for liker in self.liked if liker.count])
+
+  verb = _lazy_field('verb', 'verb', _first)
+  published = _lazy_field('published', 'published')
+  updated = _lazy_field('updated', 'updated')
+
+  @_LazyAttribute
+  def type(self, json):
+    if json.get('type'):
+      return _first(json['type'])
+    elif self.object and self.object.get('type'):
+      return self.object['type']
+    return None
+
+  @_LazyAttribute
+  def actor(self, json):
+    if json.get('author'):
+      return _person(json['author'], self.client, not self._projected)
+    elif json.get('actor'):
+      return _person(json['actor'], self.client, not self._projected)
+    return None
+
+  @_LazyAttribute
+  def attachments(self, json):
+    if self.object and self.object.get('attachments'):
+      return [
+        Attachment(attachment_json, client=self.client)
+        for attachment_json
+        in self.object['attachments']
+      ]
+    return []
+
+  geocode = _lazy_field('geocode', 'geocode', _parse_geocode)
+  place_name = _lazy_field('place_name', 'placeName')
+
+  @_LazyAttribute
+  def visibility(self, json):
+    visibility = json.get('visibility') or None
+    if isinstance(visibility, dict) and visibility.get('entries'):
+      visibility = visibility.get('entries')
+    return visibility
+
+  @_LazyAttribute
+  def source(self, json):
+    if json.get('source') and json['source'].get('title'):
+      return json['source']['title']
+    return None
 
   def __repr__(self):
     if not self.public:
@@ -1162,57 +3456,92 @@ class Post:
       client = self.client
     return client.unmute_post(post_id=self.id)
 
-class Comment:
+class Comment(object):
   """
   The L{Comment} object represents a comment on a L{Post} within Buzz. A
   comment always has an actor and content associated with it.
   """
+  _lazy_attributes = (
+    'content', 'actor', 'links', '_post_id', 'published', 'updated'
+  )
+  __slots__ = (
+    'client', 'json', '_source', '_projected', 'id', '_post'
+  ) + _lazy_slots(*_lazy_attributes)
+
   def __init__(self, json=None, client=None,
       post=None, post_id=None, content=None):
     self.client = client
     self.json = json
-    self.id = None
-    self.content = content
-    self.actor = None
-    self.links = []
-    self._post = post
-    self._post_id = post_id
-    self.published=None
-    self.updated=None
-    
-    if json:
-      # Follow Postel's law
-      try:
-        json = _prune_json_envelope(json)
-        if json.get('error'):
-          raise JSONParseError(json=json)
-        self.id = json['id']
-        if isinstance(json.get('content'), dict):
-          self.content = json['content']['value']
-        elif json.get('content'):
-          self.content = json['content']
-        elif json.get('object') and json['object'].get('content'):
-          self.content = json['object']['content']
-        if json.get('author'):
-          self.actor = Person(json['author'], client=self.client)
-        elif json.get('actor'):
-          self.actor = Person(json['actor'], client=self.client)
-        if json.get('links'):
-          self.links = _parse_links(json.get('links'))
-        if self.links:
-          for link in self.links:
-            if link.rel == "inReplyTo":
-              self._post_id = link.id
-              break
-        if json.get('published'):
-          self.published = json['published']
-        if json.get('updated'):
-          self.updated = json['updated']
-      except KeyError, e:
-        raise JSONParseError(
-          json=json,
-          exception=e
-        )
+    self._source = None
+    self._projected = False
+    self._post = post
+
+    if json:
+      # Follow Postel's law
+      self._set_item(_prune_json_envelope(json))
+    else:
+      self.id = None
+      self.links = []
+
+    # Anything given explicitly wins over the JSON
+    if content is not None or not json:
+      self.content = content
+    if post_id is not None or not json:
+      self._post_id = post_id
+
+  @classmethod
+  def _from_item(cls, json, client=None, projected=False):
+    """
+    Builds a L{Comment} from the JSON for one item of an already pruned page.
+    With C{projected}, its actor is kept apart from the shared people.
+    """
+    comment = cls.__new__(cls)
+    comment.client = client
+    comment.json = json
+    comment._projected = projected
+    comment._post = None
+    comment._set_item(json)
+    return comment
+
+  def _set_item(self, json):
+    if json.get('error'):
+      raise JSONParseError(json=json)
+    # Even the id may have been left out by a field projection
+    self.id = json.get('id')
+    # Everything else is decoded from the JSON when it's first read
+    self._source = json
+
+  @_LazyAttribute
+  def content(self, json):
+    if json.get('content'):
+      return _text(json['content'])
+    elif json.get('object') and json['object'].get('content'):
+      return json['object']['content']
+    return None
+
+  @_LazyAttribute
+  def actor(self, json):
+    if json.get('author'):
+      return _person(json['author'], self.client, not self._projected)
+    elif json.get('actor'):
+      return _person(json['actor'], self.client, not self._projected)
+    return None
+
+  @_LazyAttribute
+  def links(self, json):
+    if json.get('links'):
+      return _parse_links(json.get('links'))
+    return []
+
+  @_LazyAttribute
+  def _post_id(self, json):
+    for link in self.links:
+      if link.rel == "inReplyTo":
+        return link.id
+    return None
+
+  published = _lazy_field('published', 'published')
+  updated = _lazy_field('updated', 'updated')
 
   def __repr__(self):
     return (u'<Comment[%s]>' % self.id).encode(
@@ -1243,11 +3572,24 @@ class Comment:
           client.post(post_id=self._post_id).data
     return self._post
 
-class Link:
+class Link(object):
   """
   The L{Link} object represents a hyperlink.  It encapsulates both the URI of
   the hyperlink itself, as well as metadata such as MIME type and rel-value.
   """
+  __slots__ = (
+    'json', 'id', 'rel', 'type', 'title', 'summary', 'count', 'uri'
+  )
+  _fields = _compile_fields(
+    ('id', ('ref', 'id')),
+    ('rel', 'rel'),
+    ('type', 'type'),
+    ('title', 'title', _text),
+    ('summary', ('summary', 'content'), _text),
+    ('count', 'count'),
+    ('uri', ('href', 'uri'))
+  )
+
   def __init__(self, json=None, 
       id=None, rel=None, type=None, title=None, summary=None,
       count=None, uri=None):
@@ -1264,38 +3606,13 @@ class Link:
         json = _prune_json_envelope(json)
         if json.get('error'):
           raise JSONParseError(json=json)
-        if json.get('ref'):
-          self.id = json['ref']
-        elif json.get('id'):
-          self.id = json['id']
-        self.rel = json.get('rel') or self.rel
+        for name, read in self._fields:
+          value = read(json)
+          if value is not None:
+            setattr(self, name, value)
         if self.rel == 'page':
           # Because seriously...
           self.rel = 'alternate'
-        self.type = json.get('type') or self.type
-        if json.get('title'):
-          if isinstance(json['title'], dict):
-            self.title = json['title']['value']
-          else:
-            self.title = json['title']
-        else:
-          self.title = None
-        if isinstance(json.get('summary'), dict):
-          self.summary = json['summary']['value']
-        elif json.get('summary'):
-          self.summary = json['summary']
-        elif isinstance(json.get('content'), dict):
-          self.summary = json['content']['value']
-        elif json.get('content'):
-          self.summary = json['content']
-        else:
-          self.summary = None
-        if json.get('count'):
-          self.count = json['count']
-        if json.get('href'):
-          self.uri = json['href']
-        elif json.get('uri'):
-          self.uri = json['uri']
       except KeyError, e:
         raise JSONParseError(
           json=json,
@@ -1322,12 +3639,21 @@ class Link:
       output['href'] = self.uri
     return output
 
-class Attachment:
+class Attachment(object):
   """
   The L{Attachment} object represents an attachment to a L{Post} within Buzz.
   It may contain rich media types such as video, audio, pictures, or just
   simple hyperlinks.
   """
+  __slots__ = (
+    'client', 'json', 'type', 'title', 'content', 'uri', 'link', 'links',
+    'preview', 'enclosure'
+  )
+  _fields = _compile_fields(
+    ('content', 'content', _text),
+    ('title', 'title', _text)
+  )
+
   def __init__(self, json=None, client=None,
       type=None, title=None, content=None, uri=None,
       preview=None, enclosure=None):
@@ -1346,17 +3672,10 @@ class Attachment:
         json = _prune_json_envelope(json)
         if json.get('error'):
           raise JSONParseError(json=json)
-        if isinstance(json.get('content'), dict):
-          self.content = json['content']['value']
-        elif json.get('content'):
-          self.content = json['content']
-        if json.get('title'):
-          if isinstance(json['title'], dict):
-            self.title = json['title']['value']
-          else:
-            self.title = json['title']
-        else:
-          self.title = None
+        for name, read in self._fields:
+          value = read(json)
+          if value is not None:
+            setattr(self, name, value)
         if json.get('links'):
           self.links = _parse_links(json.get('links'))
         if self.links:
@@ -1368,7 +3687,7 @@ class Attachment:
               self.preview = link
             elif link.rel == "enclosure":
               self.enclosure = link
-        self.type = json['type']
+        self.type = json.get('type')
       except KeyError, e:
         raise JSONParseError(
           json=json,
@@ -1403,7 +3722,20 @@ class Attachment:
       }
     return output
 
-class Album:
+class Album(object):
+  __slots__ = (
+    'client', 'json', 'id', 'title', 'content', 'owner', 'created',
+    'last_modified', 'version', 'uri', 'link', 'links'
+  )
+  _fields = _compile_fields(
+    ('id', 'id'),
+    ('content', ('content', 'description'), _text),
+    ('title', 'title', _text),
+    ('created', 'created'),
+    ('last_modified', 'lastModified'),
+    ('version', 'version')
+  )
+
   def __init__(self, json=None, client=None,
       title=None, content=None):
       
@@ -1424,29 +3756,10 @@ class Album:
         json = _prune_json_envelope(json)
         if json.get('error'):
           raise JSONParseError(json=json)
-        if json.get('id'):
-          self.id = json['id']
-        if isinstance(json.get('content'), dict):
-          self.content = json['content']['value']
-        elif json.get('content'):
-          self.content = json['content']
-        elif json.get('description'):
-          self.content = json['description']
-        else:
-          self.content = None
-        if json.get('title'):
-          if isinstance(json['title'], dict):
-            self.title = json['title']['value']
-          else:
-            self.title = json['title']
-        else:
-          self.title = None
-        if json.get('created'):
-          self.created = json['created']
-        if json.get('lastModified'):
-          self.last_modified = json['lastModified']
-        if json.get('version'):
-          self.version = json['version']
+        for name, read in self._fields:
+          value = read(json)
+          if value is not None:
+            setattr(self, name, value)
         if json.get('links'):
           self.links = _parse_links(json.get('links'))
         if self.links:
@@ -1460,9 +3773,9 @@ class Album:
                 self.link = link
                 self.uri = self.link.uri
         if json.get('actor'):
-          self.owner = Person(json['actor'], client=self.client)
+          self.owner = _person(json['actor'], self.client)
         elif json.get('owner'):
-          self.owner = Person(json['owner'], client=self.client)
+          self.owner = _person(json['owner'], self.client)
       except KeyError, e:
         raise JSONParseError(
           json=json,
@@ -1500,7 +3813,21 @@ class Album:
   #     }
   #   return output
 
-class Photo:
+class Photo(object):
+  __slots__ = (
+    'client', 'json', 'id', 'title', 'content', 'owner', 'created',
+    'last_modified', 'timestamp', 'version', 'uri', 'link', 'links'
+  )
+  _fields = _compile_fields(
+    ('id', 'id'),
+    ('content', ('content', 'description'), _text),
+    ('title', 'title', _text),
+    ('created', 'created'),
+    ('last_modified', 'lastModified'),
+    ('timestamp', 'timestamp'),
+    ('version', 'version')
+  )
+
   def __init__(self, json=None, client=None,
       title=None, content=None):
 
@@ -1522,31 +3849,10 @@ class Photo:
         json = _prune_json_envelope(json)
         if json.get('error'):
           raise JSONParseError(json=json)
-        if json.get('id'):
-          self.id = json['id']
-        if isinstance(json.get('content'), dict):
-          self.content = json['content']['value']
-        elif json.get('content'):
-          self.content = json['content']
-        elif json.get('description'):
-          self.content = json['description']
-        else:
-          self.content = None
-        if json.get('title'):
-          if isinstance(json['title'], dict):
-            self.title = json['title']['value']
-          else:
-            self.title = json['title']
-        else:
-          self.title = None
-        if json.get('created'):
-          self.created = json['created']
-        if json.get('lastModified'):
-          self.last_modified = json['lastModified']
-        if json.get('timestamp'):
-          self.timestamp = json['timestamp']
-        if json.get('version'):
-          self.version = json['version']
+        for name, read in self._fields:
+          value = read(json)
+          if value is not None:
+            setattr(self, name, value)
         if json.get('links'):
           self.links = _parse_links(json.get('links'))
         if self.links:
@@ -1560,9 +3866,9 @@ class Photo:
                 self.link = link
                 self.uri = self.link.uri
         if json.get('actor'):
-          self.owner = Person(json['actor'], client=self.client)
+          self.owner = _person(json['actor'], self.client)
         elif json.get('owner'):
-          self.owner = Person(json['owner'], client=self.client)
+          self.owner = _person(json['owner'], self.client)
       except KeyError, e:
         raise JSONParseError(
           json=json,
@@ -1594,53 +3900,106 @@ class Photo:
   #     }
   #   return output
 
-class Person:
+class Person(object):
   """
   The L{Person} object represents a Buzz user.  L{Person} objects may be
   associated with L{Post} or L{Comment} objects as authors, or with other
   L{Person} objects as followers.
   """
+  _lazy_attributes = (
+    'uri', 'id', 'name', 'photo', 'uris', 'photos', 'profile_name'
+  )
+  __slots__ = (
+    'client', 'json', '_source', '__weakref__'
+  ) + _lazy_slots(*_lazy_attributes)
+
   def __init__(self, json, client=None):
     self.client = client
     self.json = json
-    self.profile_name = None
     # Follow Postel's law
-    try:
-      json = _prune_json_envelope(json)
-      if json.get('error'):
-        raise JSONParseError(json=json)
-      self.uri = \
-        json.get('uri') or json.get('profileUrl')
-      if self.uri == "":
-        self.uri = None
-      if json.get('id'):
-        self.id = json.get('id')
-      elif self.uri:
-        self.id = re.search('/([^/]*?)$', self.uri).group(1)
-      self.name = \
-        json.get('name') or json.get('displayName')
-      self.photo = \
-        json.get('photoUrl') or json.get('thumbnailUrl')
-      if self.photo and self.photo.startswith('/photos/public/'):
-        self.photo = 'http://www.google.com/s2' + self.photo
-      if json.get('urls'):
-        self.uris = json.get('urls')
-      if json.get('photos'):
-        self.photos = json.get('photos')
-      if self.uri and \
-          not re.search('^\\d+$', re.search('/([^/]*?)$', self.uri).group(1)):
-        self.profile_name = re.search('/([^/]*?)$', self.uri).group(1)
-    except KeyError, e:
-      raise JSONParseError(
-        json=json,
-        exception=e
-      )
+    self._set_item(_prune_json_envelope(json))
+
+  @classmethod
+  def _from_item(cls, json, client=None):
+    """
+    Builds a L{Person} from the JSON for one item of an already pruned page.
+    """
+    person = cls.__new__(cls)
+    person.client = client
+    person.json = json
+    person._set_item(json)
+    return person
+
+  def _set_item(self, json):
+    if json.get('error'):
+      raise JSONParseError(json=json)
+    # Everything else is decoded from the JSON when it's first read
+    self._source = json
+
+  uri = _lazy_field('uri', ('uri', 'profileUrl'))
+
+  @_LazyAttribute
+  def id(self, json):
+    if json.get('id'):
+      return json.get('id')
+    elif self.uri:
+      return re.search('/([^/]*?)$', self.uri).group(1)
+    return None
+
+  name = _lazy_field('name', ('name', 'displayName'))
+
+  @_LazyAttribute
+  def photo(self, json):
+    photo = json.get('photoUrl') or json.get('thumbnailUrl')
+    if photo and photo.startswith('/photos/public/'):
+      photo = 'http://www.google.com/s2' + photo
+    return photo
+
+  uris = _lazy_field('uris', 'urls')
+  photos = _lazy_field('photos', 'photos')
+
+  @_LazyAttribute
+  def profile_name(self, json):
+    if self.uri:
+      name = re.search('/([^/]*?)$', self.uri).group(1)
+      if not re.search('^\\d+$', name):
+        return name
+    return None
 
   def __repr__(self):
     return (u'<Person[%s, %s]>' % (self.name, self.id)).encode(
       'ASCII', 'ignore'
     )
 
+  def _lacks_fields(self, json):
+    """
+    Whether the JSON has fields this person wasn't built from.  Once the
+    JSON has been let go, that can't be told, so it's taken not to.
+    """
+    source = self._source or self.json
+    if source is None or not isinstance(json, dict):
+      return False
+    for key in json:
+      if key not in source:
+        return True
+    return False
+
+  def _merge(self, json):
+    """Adds the fields of the JSON to those this person was built from."""
+    merged = dict(self._source or self.json)
+    merged.update(json)
+    self._update(Person._from_item(merged, self.client))
+
+  def _update(self, person):
+    """Replaces every field with those of another L{Person} object."""
+    self.json = person.json
+    self._source = person._source
+    for slot in _lazy_slots(*self._lazy_attributes):
+      if hasattr(person, slot):
+        setattr(self, slot, getattr(person, slot))
+      elif hasattr(self, slot):
+        delattr(self, slot)
+
   @property
   def _json_output(self):
     output = {}
@@ -1672,15 +4031,69 @@ class Person:
       client = self.client
     return client.posts(user_id=self.id)
 
+def _model_decoder(model):
+  """
+  Returns a decoder which builds a model from the JSON for an item.  People
+  within items of a projected page are never shared, since they may be
+  missing fields.
+  """
+  from_item = getattr(model, '_from_item', None)
+  if from_item:
+    def decode(json, result):
+      return from_item(json, result.client, projected=result._projected)
+  else:
+    def decode(json, result):
+      if not result._projected:
+        return model(json, client=result.client)
+      # Without a client the owner isn't shared; it's given one afterwards
+      value = model(json)
+      value.client = result.client
+      if getattr(value, 'owner', None):
+        value.owner.client = result.client
+      return value
+  return decode
+
+def _decode_person(json, result):
+  if result.singular and not result._projected:
+    # A full profile, so anything else that refers to this person sees it.
+    # A projected one would leave the shared Person without its other fields.
+    return result.client._shared_person(json, upgrade=True)
+  return Person._from_item(json, result.client)
+
+def _decode_link(json, result):
+  return Link(json)
+
+# How L{Result} builds an object from the JSON for each item, by result type.
+# Each decoder is called with the item's JSON and the L{Result}; adding one
+# here is all it takes to support a new type of result.
+RESULT_DECODERS = {
+  Post: _model_decoder(Post),
+  Comment: _model_decoder(Comment),
+  Person: _decode_person,
+  Link: _decode_link,
+  Album: _model_decoder(Album),
+  Photo: _model_decoder(Photo)
+}
+
 class Result:
   """
   The L{Result} object encapsulates each result returned from the API.
   """
   def __init__(self, client, http_method, http_uri, http_headers={}, \
-      http_body='', result_type=Post, singular=False):
+      http_body='', result_type=Post, singular=False, concurrency=1,
+      endpoint=None, raw=False, item_filter=None):
     self.client = client
     self.result_type = result_type
     self.singular = singular
+    # Whether to hand over the JSON for each item instead of building models
+    self.raw = raw
+    # Called with the JSON for each item of a page, which is left out unless
+    # this returns true
+    self.item_filter = item_filter
+    # The name of the Client method this result came from
+    self.endpoint = endpoint
+    # How many pages of a Portable Contacts feed may be fetched at once
+    self.concurrency = concurrency
 
     # The HTTP response for the current page
     self._response = None
@@ -1690,94 +4103,258 @@ class Result:
     self._json = None
     # The parsed data for the current page
     self._data = None
-    # The URI of the next page of results
-    self._next_uri = None
-
-    self._http_method = http_method
-    self._http_uri = http_uri
+    # Whether the page last streamed had any items, before filtering
+    self._streamed_any = False
+    # The request for the next page of results
+    self._next_request = None
+    # Validators for revalidating the current page with a conditional GET
+    self._etag = None
+    self._last_modified = None
+
+    if not isinstance(http_uri, _APIRequest):
+      http_uri = _APIRequest.from_uri(http_method, http_uri, http_body)
+    # The request for the current page
+    self._request = http_uri
     self._http_headers = http_headers
-    self._http_body = http_body
     self.poco_count = 0
 
+  @property
+  def _http_method(self):
+    return self._request.http_method
+
+  @property
+  def _http_uri(self):
+    return self._request.uri
+
+  @property
+  def _http_body(self):
+    return self._request.http_body
+
+  @property
+  def _projected(self):
+    """Whether only some fields of each item were asked for."""
+    return 'fields' in self._request.parameters
+
   def __iter__(self):
     return ResultIterator(self)
 
+  def iterator(self, prefetch=0, stream=False, raw=False, item_filter=None):
+    """
+    Returns a L{ResultIterator} over every page of this result.
+
+    @type prefetch: int
+    @param prefetch: The number of upcoming pages to fetch on a background
+      thread while the current page is being consumed.  Zero fetches each
+      page on demand.
+    @type stream: bool
+    @param stream: Whether to decode each page as it arrives, handing over
+      every item as soon as it is complete instead of once the whole page
+      has been downloaded.  Streamed pages are fetched one at a time and
+      are never cached or kept in memory, so this can't be combined with
+      C{prefetch}.
+    @type raw: bool
+    @param raw: Whether to hand over the JSON C{dict} for each item instead
+      of building L{Post}, L{Person} or other objects from it.
+    @type item_filter: callable
+    @param item_filter: A predicate that's called with the JSON C{dict} for
+      each item, before any object is built from it.  Items it rejects are
+      skipped, and pages are fetched until enough items have matched.
+
+    With C{raw} or C{item_filter}, the iterator works on a copy of this
+    result, whose own L{data} is left unchanged.
+    """
+    result = self
+    if (raw and not self.raw) or \
+        (item_filter and item_filter is not self.item_filter):
+      # Iterate over a copy, so that this result's own data is left as it was
+      result = copy.copy(self)
+      result.raw = raw or self.raw
+      result.item_filter = item_filter or self.item_filter
+      # Any page that's already been fetched is converted again
+      result._data = None
+    return ResultIterator(result, prefetch=prefetch, stream=stream)
+
   @property
   def data(self):
-    if not self._data:
-      if not self._response:
-        self.reload()
-      if not (self._response.status >= 200 and self._response.status < 300):
-        # Response was not a 2xx class status
-        self._parse_error(self._json)
-      if self.result_type == Post and self.singular:
-        self._data = self._parse_post(self._json)
-      elif self.result_type == Post and not self.singular:
-        self._data = self._parse_posts(self._json)
-      elif self.result_type == Comment and self.singular:
-        self._data = self._parse_comment(self._json)
-      elif self.result_type == Comment and not self.singular:
-        self._data = self._parse_comments(self._json)
-      elif self.result_type == Person and self.singular:
-        self._data = self._parse_person(self._json)
-      elif self.result_type == Person and not self.singular:
-        self._data = self._parse_people(self._json)
-      elif self.result_type == Link and self.singular:
-        self._data = self._parse_link(self._json)
-      elif self.result_type == Link and not self.singular:
-        self._data = self._parse_links(self._json)
-      elif self.result_type == Album and self.singular:
-        self._data = self._parse_album(self._json)
-      elif self.result_type == Album and not self.singular:
-        self._data = self._parse_albums(self._json)
-      elif self.result_type == Photo and self.singular:
-        self._data = self._parse_photo(self._json)
-      elif self.result_type == Photo and not self.singular:
-        self._data = self._parse_photos(self._json)
+    if self._data is None:
+      single_flight = self.client.single_flight
+      if single_flight and not self._response and self._http_method == 'GET':
+        self._response, self._body, self._json, self._data = \
+          single_flight.do(self._flight_key(), self._load)
+      else:
+        self._load()
     return self._data
 
+  def _cache_key(self):
+    consumer_key = None
+    token_key = None
+    if self.client.oauth_consumer:
+      consumer_key = self.client.oauth_consumer.key
+    if self.client.oauth_access_token:
+      token_key = self.client.oauth_access_token.key
+    return (self._request.key, consumer_key, token_key)
+
+  def _flight_key(self):
+    return (self._http_method, self._cache_key(), self.result_type,
+      self.singular, self.raw, self.item_filter)
+
+  def _load(self):
+    if not self._response:
+      response_cache = self.client.response_cache
+      json = None
+      if response_cache and self._http_method == 'GET':
+        json = response_cache.get(self._cache_key())
+      if json is not None:
+        self._response = _BufferedResponse(200, 'OK')
+        self._body = None
+        self._json = json
+      else:
+        if response_cache and self._http_method == 'GET' and \
+            self._json is None:
+          entry = response_cache.stale(self._cache_key())
+          if entry:
+            # Revalidate the expired entry rather than fetching it again
+            self._json = entry.json
+            self._etag = entry.etag
+            self._last_modified = entry.last_modified
+        self.reload()
+    if not (self._response.status >= 200 and self._response.status < 300) \
+        and self._response.status != 304:
+      # Response was not a 2xx class status
+      self._parse_error(self._json)
+    self._data = self._decode_page(self._json)
+    return self._response, self._body, self._json, self._data
+
   def reload(self):
     if DEBUG:
       logging.debug('URI to fetch is %s' % self._http_uri)
       logging.debug('Headers are: %s' % str(self._http_headers))
+    http_headers = self._http_headers
+    previous = None
+    if self._http_method == 'GET' and self._json is not None and \
+        (self._etag or self._last_modified):
+      # Only download the page again if it has changed
+      http_headers = dict(http_headers)
+      if self._etag:
+        http_headers['If-None-Match'] = self._etag
+      if self._last_modified:
+        http_headers['If-Modified-Since'] = self._last_modified
+      previous = (self._body, self._json, self._data)
     self._data = None
     self._response = self.client.fetch_api_response(
       http_method=self._http_method,
-      http_uri=self._http_uri,
-      http_headers=self._http_headers,
+      http_uri=self._request,
+      http_headers=http_headers,
       http_body=self._http_body
     )
+    response_cache = self.client.response_cache
+    if self._response.status == 304 and previous:
+      # Not modified, so the page we already have is still good
+      self._response.read()
+      self._body, self._json, self._data = previous
+      if response_cache:
+        response_cache.revalidated(self._cache_key(), self.endpoint)
+      return
+    self._etag = self._response.getheader('ETag')
+    self._last_modified = self._response.getheader('Last-Modified')
     self._body = self._response.read()
     try:
       if self._body == '':
         self._json = None
       else:
-        # Use a custom decoder so that we can switch off strict mode so that illegal control characters don't break
-        # things
-        decoder = simplejson.JSONDecoder(strict=False)
-        self._json = decoder.decode(self._body)
+        self._json = JSON_BACKEND.decode(self._body)
     except Exception, e:
       raise JSONParseError(
         json=(self._json or self._body),
         uri=self._http_uri,
         exception=e
       )
+    if response_cache and self._http_method == 'GET' and \
+        self._json is not None and \
+        self._response.status >= 200 and self._response.status < 300:
+      response_cache.put(
+        self._cache_key(), self._json, len(self._body), self.endpoint,
+        etag=self._etag, last_modified=self._last_modified
+      )
+
+  def _stream_items(self):
+    """
+    Fetches the current page and yields its items as they are decoded from
+    the response, without holding on to them.  Afterwards only the envelope
+    of the page is kept, which is enough to find the next page.
+    """
+    if self.singular:
+      raise ValueError('Only collections can be streamed.')
+    if self._response:
+      # This page has already been loaded in full
+      self._streamed_any = self._has_items()
+      for value in self.data:
+        yield value
+      return
+    if DEBUG:
+      logging.debug('URI to stream is %s' % self._http_uri)
+      logging.debug('Headers are: %s' % str(self._http_headers))
+    self._data = None
+    response = self.client.fetch_api_response(
+      http_method=self._http_method,
+      http_uri=self._request,
+      http_headers=self._http_headers,
+      http_body=self._http_body
+    )
+    decoder = JSON_BACKEND.decoder
+    if not (response.status >= 200 and response.status < 300):
+      # Response was not a 2xx class status
+      body = response.read()
+      try:
+        json = body and decoder.decode(body) or None
+      except ValueError:
+        json = None
+      self._parse_error(json)
+    stream = _JSONStream(response, decoder)
+    item_filter = self.item_filter
+    self._streamed_any = False
+    try:
+      for item_json in stream.items():
+        self._streamed_any = True
+        if item_filter and not item_filter(item_json):
+          continue
+        yield self._decode_item(item_json)
+    except ValueError, e:
+      raise JSONParseError(
+        json=stream.envelope,
+        uri=self._http_uri,
+        exception=e
+      )
+    self._json = stream.envelope
 
   def load_next(self):
     if self.next_uri:
-      self._http_uri = self.next_uri
+      self._request = self._next_request
       # Reset all of these
-      self._next_uri = None
+      self._next_request = None
       self._response = None
       self._body = None
       self._json = None
       self._data = None
+      self._streamed_any = False
+      self._etag = None
+      self._last_modified = None
     else:
       raise ValueError('Cannot load next page, next page not present.')
 
+  def _has_items(self):
+    """
+    Whether the current page had any items at all, before they were filtered.
+    A page without any is the last.
+    """
+    if not self._json:
+      return False
+    items = _prune_json_envelope(self._json)
+    return isinstance(items, list) and len(items) > 0
+
   @property
   def next_uri(self):
-    if not self._next_uri:
+    if not self._next_request:
       if self.singular:
         return None
       else:
@@ -1789,18 +4366,15 @@ class Result:
       if semi_pruned_json.get('kind') == 'buzz#peopleFeed':
         total_results = semi_pruned_json.get('totalResults')
         if semi_pruned_json.get('startIndex') < total_results:
-          if 'c=' in self._http_uri:
-            old_param = '&c=%s' % self.poco_count
+          if 'c' in self._request.parameters:
             self.poco_count += DEFAULT_PAGE_SIZE
-            new_param = '&c=%s' % self.poco_count
-            self._next_uri = self._http_uri.replace(old_param, new_param)
           else:
-            self._next_uri = self._http_uri + '&c=%s' % DEFAULT_PAGE_SIZE
             self.poco_count = DEFAULT_PAGE_SIZE
+          self._next_request = self._request.with_param('c', self.poco_count)
           if self.poco_count >= total_results:
             # Finished processing PoCo
             return None
-          return self._next_uri
+          return self._next_request.uri
       else:
         links = semi_pruned_json.get('links')
         if not links:
@@ -1808,226 +4382,83 @@ class Result:
         next_link = links.get('next')
         if not next_link:
           return None
-        self._next_uri = next_link[0].get('href')
-        if not self._next_uri:
+        next_uri = next_link[0].get('href')
+        if not next_uri:
           return None
-    return self._next_uri
-
-  def _parse_post(self, json):
-    """Helper method for converting a post JSON structure."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list) and len(json) == 1:
-        json = json[0]
-      return Post(json, client=self.client)
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_posts(self, json):
-    """Helper method for converting a set of post JSON structures."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list):
-        return [
-          Post(post_json, client=self.client) for post_json in json
-        ]
-      else:
-        # The entire key is omitted when there are no results
-        return []
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_comment(self, json):
-    """Helper method for converting a comment JSON structure."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list) and len(json) == 1:
-        json = json[0]
-      return Comment(json, client=self.client)
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_comments(self, json):
-    """Helper method for converting a set of comment JSON structures."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list):
-        return [
-          Comment(comment_json, client=self.client) for comment_json in json
-        ]
-      else:
-        # The entire key is omitted when there are no results
-        return []
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_person(self, json):
-    """Helper method for converting a person JSON structure."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list) and len(json) == 1:
-        json = json[0]
-      return Person(json, client=self.client)
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_people(self, json):
-    """Helper method for converting a set of person JSON structures."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list):
-        return [
-          Person(person_json, client=self.client) for person_json in json
-        ]
-      else:
-        # The entire key is omitted when there are no results
-        return []
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_link(self, json):
-    """Helper method for converting a person JSON structure."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list) and len(json) == 1:
-        json = json[0]
-      return Link(json)
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_links(self, json):
-    """Helper method for converting a set of person JSON structures."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list):
-        return [
-          Link(link_json) for link_json in json
-        ]
-      else:
-        # The entire key is omitted when there are no results
-        return []
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_album(self, json):
-    """Helper method for converting an album JSON structure."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list) and len(json) == 1:
-        json = json[0]
-      return Album(json, client=self.client)
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_albums(self, json):
-    """Helper method for converting a set of album JSON structures."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list):
-        return [
-          Album(post_json, client=self.client) for post_json in json
-        ]
-      else:
-        # The entire key is omitted when there are no results
-        return []
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
+        next_request = _APIRequest.from_uri(
+          self._http_method, next_uri, self._http_body
+        )
+        for name in ('fields', 'prettyPrint'):
+          value = self._request.parameters.get(name)
+          if value is not None and name not in next_request.parameters:
+            # The API doesn't always carry these over into its links
+            next_request = next_request.with_param(name, value)
+        self._next_request = next_request
+    if not self._next_request:
+      return None
+    return self._next_request.uri
+
+  def _poco_page_requests(self):
+    """
+    Returns the requests for every remaining page of a Portable Contacts
+    feed, or C{None} if this isn't one.  Unlike other feeds, these pages are
+    all known as soon as the first page has arrived.
+    """
+    if self.singular:
+      return None
+    if not self._json:
+      self.reload()
+    semi_pruned_json = self._json.get('data') or self._json
+    if semi_pruned_json.get('kind') != 'buzz#peopleFeed':
+      return None
+    total_results = semi_pruned_json.get('totalResults') or 0
+    return [
+      self._request.with_param('c', offset) for offset in range(
+        self.poco_count + DEFAULT_PAGE_SIZE, total_results, DEFAULT_PAGE_SIZE
       )
+    ]
 
-  def _parse_photo(self, json):
-    """Helper method for converting a photo JSON structure."""
-    try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
+  def _decode_page(self, json):
+    """
+    Converts the JSON for a page into objects of the result type with its
+    decoder from L{RESULT_DECODERS}, pruning the envelope only once.
+    """
+    if self.result_type is None and not self.raw:
+      return None
+    if json.get('error'):
+      self._parse_error(json)
+    json = _prune_json_envelope(json)
+    if self.singular:
       if isinstance(json, list) and len(json) == 1:
         json = json[0]
-      return Photo(json, client=self.client)
-    except KeyError, e:
-      raise JSONParseError(
-        uri=self._http_uri,
-        json=json,
-        exception=e
-      )
-
-  def _parse_photos(self, json):
-    """Helper method for converting a set of photo JSON structures."""
+      return self._decode_item(json)
+    elif isinstance(json, list):
+      if self.item_filter:
+        # Rejected items never get as far as being decoded
+        json = [item_json for item_json in json if self.item_filter(item_json)]
+      return [self._decode_item(item_json) for item_json in json]
+    else:
+      # The entire key is omitted when there are no results
+      return []
+
+  def _decode_item(self, json):
+    if self.raw or self.result_type is None:
+      return json
+    decode = RESULT_DECODERS.get(self.result_type)
+    if not decode:
+      raise TypeError('No decoder for results of type %s' % self.result_type)
     try:
-      if json.get('error'):
-        self.parse_error(json)
-      json = _prune_json_envelope(json)
-      if isinstance(json, list):
-        return [
-          Photo(post_json, client=self.client) for post_json in json
-        ]
-      else:
-        # The entire key is omitted when there are no results
-        return []
+      value = decode(json, self)
+      if not self.client.retain_json:
+        # Decode everything now so that the JSON can be let go
+        _release_json(value)
     except KeyError, e:
       raise JSONParseError(
         uri=self._http_uri,
         json=json,
         exception=e
       )
+    return value
 
   def _parse_error(self, json):
     """Helper method for converting an error response to an exception."""
@@ -2044,37 +4475,220 @@ class Result:
       )
     
 
+class _PagePrefetcher:
+  """
+  Fetches the pages of a L{Result} on a background thread, keeping up to
+  C{depth} pages ready ahead of the consumer.  Pages are handed over in order,
+  and an exception raised while fetching a page is handed over in its place.
+  """
+  def __init__(self, result, depth):
+    # Work on a copy so the caller's Result is never touched from two threads
+    self._result = copy.copy(result)
+    self._pages = Queue.Queue(depth)
+    self._stopped = threading.Event()
+    self._finished = False
+    self._thread = threading.Thread(target=self._run)
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+  def _run(self):
+    result = self._result
+    try:
+      while not self._stopped.isSet():
+        data = result.data
+        if not self._put((data, None)):
+          return
+        if not result._has_items() or not result.next_uri:
+          break
+        if self._stopped.isSet():
+          # Nobody is left to consume the next page
+          return
+        result.load_next()
+    except Exception:
+      self._put((None, sys.exc_info()))
+      return
+    # The end of the results
+    self._put((None, None))
+
+  def _put(self, page):
+    """
+    Waits for room in the queue to hand over a page, giving up as soon as
+    the prefetcher is closed.  Returns whether the page was handed over.
+    """
+    while not self._stopped.isSet():
+      try:
+        self._pages.put(page, timeout=0.1)
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def next_page(self):
+    """Returns the next page of data, or C{None} after the last page."""
+    if self._finished:
+      return None
+    data, exc_info = self._pages.get()
+    if exc_info:
+      self.close()
+      raise exc_info[0], exc_info[1], exc_info[2]
+    if data is None:
+      self.close()
+    return data
+
+  def close(self):
+    """Stops fetching pages that will never be consumed."""
+    self._finished = True
+    self._stopped.set()
+    # Unblock the worker if it's waiting for room in the queue
+    try:
+      while True:
+        self._pages.get_nowait()
+    except Queue.Empty:
+      pass
+
+class _PageFanout:
+  """
+  Fetches the remaining pages of a Portable Contacts feed concurrently,
+  handing them over in order.  At most C{concurrency} pages are fetched at
+  once, and only a few pages are ever buffered ahead of the consumer.
+  """
+  def __init__(self, result, page_requests, concurrency):
+    self._result = result
+    self._first_page = result.data
+    self._page_requests = iter(page_requests)
+    self._pending = collections.deque()
+    self._workers = WorkerPool(concurrency)
+    for i in range(concurrency * 2):
+      self._submit_next()
+
+  def _submit_next(self):
+    for page_request in self._page_requests:
+      self._pending.append(
+        self._workers.submit(self._fetch_page, page_request)
+      )
+      break
+
+  def _fetch_page(self, page_request):
+    result = self._result
+    page = Result(
+      result.client, result._http_method, page_request,
+      http_headers=result._http_headers, result_type=result.result_type,
+      endpoint=result.endpoint, raw=result.raw, item_filter=result.item_filter
+    )
+    return page.data
+
+  def next_page(self):
+    """Returns the next page of data, or C{None} after the last page."""
+    if self._first_page is not None:
+      page, self._first_page = self._first_page, None
+      return page
+    if not self._pending:
+      self.close()
+      return None
+    future = self._pending.popleft()
+    self._submit_next()
+    try:
+      return future.result()
+    except:
+      self.close()
+      raise
+
+  def close(self):
+    """Stops fetching pages that will never be consumed."""
+    self._pending.clear()
+    self._page_requests = iter([])
+    self._workers.shutdown(cancel=True)
+
 class ResultIterator:
   """
   A L{ResultIterator} allows iteration over a result set.
   """
-  def __init__(self, result):
+  def __init__(self, result, prefetch=0, stream=False):
+    if stream and prefetch:
+      raise ValueError('Streamed results cannot be prefetched.')
     self.result = result
     self.cursor = 0
     self.start_index = 0
+    self.prefetch = prefetch
+    self.stream = stream
+    self._stream = None
+    self._prefetcher = None
+    self._page = None
+    self._opened = False
 
   def __iter__(self):
     return self
 
+  def __del__(self):
+    self.close()
+
+  def close(self):
+    """Stops any background fetching of upcoming pages."""
+    if self._prefetcher:
+      self._prefetcher.close()
+    if self._stream:
+      self._stream.close()
+      self._stream = None
+
   @property
   def local_index(self):
     return self.cursor - self.start_index
 
+  def _open_pages(self):
+    self._opened = True
+    if self.result.concurrency > 1:
+      # Make sure errors on the first page surface just as they usually would
+      self.result.data
+      page_requests = self.result._poco_page_requests()
+      if page_requests is not None:
+        self._prefetcher = \
+          _PageFanout(self.result, page_requests, self.result.concurrency)
+    if not self._prefetcher and self.prefetch:
+      self._prefetcher = _PagePrefetcher(self.result, self.prefetch)
+    if self._prefetcher:
+      self._page = self._prefetcher.next_page() or []
+
+  def _next_prefetched(self):
+    # Pages where every item was filtered out are skipped
+    while self.local_index >= len(self._page):
+      page = self._prefetcher.next_page()
+      if page is None:
+        raise StopIteration('No more results.')
+      self.start_index += len(self._page)
+      self._page = page
+    value = self._page[self.local_index]
+    self.cursor += 1
+    return value
+
+  def _next_streamed(self):
+    while True:
+      if self._stream is None:
+        self._stream = self.result._stream_items()
+      try:
+        value = self._stream.next()
+        self.cursor += 1
+        return value
+      except StopIteration:
+        self._stream = None
+      if not self.result._streamed_any or not self.result.next_uri:
+        raise StopIteration('No more results.')
+      self.start_index = self.cursor
+      self.result.load_next()
+
   def next(self):
-    if self.local_index >= len(self.result.data):
-      if self.result.next_uri:
-        self.start_index += len(self.result.data)
-        self.result.load_next()
-      else:
+    if self.stream:
+      return self._next_streamed()
+    if not self._opened and (self.prefetch or self.result.concurrency > 1):
+      self._open_pages()
+    if self._prefetcher:
+      return self._next_prefetched()
+    # Pages where every item was filtered out are skipped, but a page that
+    # had no items to begin with is the last
+    while self.local_index >= len(self.result.data):
+      if not self.result._has_items() or not self.result.next_uri:
         raise StopIteration('No more results.')
-    if not self.result.data:
-      raise StopIteration('No data.')
-    if self.local_index >= len(self.result.data):
-      raise IndexError(
-        'Local index %d out of range for data set of size %d' % (
-          self.local_index, len(self.result.data)
-        )
-      )
+      self.start_index += len(self.result.data)
+      self.result.load_next()
 
     # The local_index is in range of the current page
     value = self.result.data[self.local_index]
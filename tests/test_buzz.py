@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import atexit
 import os
 import sys
 
@@ -7,6 +8,10 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import buzz
 import time
 import re
+import tempfile
+import threading
+import cgi
+import BaseHTTPServer
 from pprint import pprint
 try:
   import yaml
@@ -16,11 +21,43 @@ except (ImportError):
 try:
   import nose
   from nose.tools import make_decorator
+  from nose.plugins.skip import SkipTest
   NOSE_ENABLED = True
 except (ImportError):
   NOSE_ENABLED = False
+  class SkipTest(Exception):
+    pass
+
+# Set BUZZ_CASSETTE_PATH to replay recorded API responses instead of calling
+# the live API, and BUZZ_RECORD as well to record them there.
+CASSETTE_PATH = os.environ.get('BUZZ_CASSETTE_PATH')
+RECORDING = bool(CASSETTE_PATH and os.environ.get('BUZZ_RECORD'))
+
+CREDENTIALS = (
+  'oauth_consumer_key', 'oauth_consumer_secret', 'oauth_token_key',
+  'oauth_token_secret'
+)
+HAS_CREDENTIALS = not [
+  name for name in CREDENTIALS if not buzz.CLIENT_CONFIG.get(name)
+]
 
 TEST_CONFIG = buzz.CLIENT_CONFIG
+if not RECORDING:
+  # Replaying needs no credentials, since they're never recorded, and tests
+  # that don't call the API need none at all.  The testing ids are part of
+  # the recorded URIs, so any in the config file should be the ones the
+  # cassette was recorded with.
+  TEST_CONFIG = dict({
+    'oauth_consumer_key': 'consumer key',
+    'oauth_consumer_secret': 'consumer secret',
+    'oauth_token_key': 'token key',
+    'oauth_token_secret': 'token secret',
+    'testing_id': '1',
+    'testing_account': 'tester',
+    'testing_target_id': '2',
+    'testing_target_account': 'target',
+    'testing_post_id': 'tag:google.com,2010:buzz:1'
+  }, **TEST_CONFIG)
 
 OAUTH_CONSUMER_KEY = TEST_CONFIG['oauth_consumer_key']
 OAUTH_CONSUMER_SECRET = TEST_CONFIG['oauth_consumer_secret']
@@ -33,6 +70,22 @@ BUZZ_TARGET_ID = str(TEST_CONFIG['testing_target_id'])
 BUZZ_TARGET_ACCOUNT = str(TEST_CONFIG['testing_target_account'])
 BUZZ_POST_ID = str(TEST_CONFIG['testing_post_id'])
 
+if CASSETTE_PATH and (RECORDING or os.path.exists(CASSETTE_PATH)):
+  buzz.DEFAULT_TRANSPORT = buzz.Cassette(
+    CASSETTE_PATH,
+    record=RECORDING,
+    latency=float(os.environ.get('BUZZ_REPLAY_LATENCY') or 0)
+  )
+  if RECORDING:
+    # Written once, after every test has run
+    atexit.register(buzz.DEFAULT_TRANSPORT.save)
+  API_AVAILABLE = True
+elif CASSETTE_PATH:
+  # Without the cassette there's nothing to replay
+  API_AVAILABLE = False
+else:
+  API_AVAILABLE = HAS_CREDENTIALS
+
 CLIENT = buzz.Client()
 CLIENT.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
 CLIENT.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
@@ -55,6 +108,34 @@ def dumpjson(test_method):
   else:
     return dumpjson_runner
 
+def needs_api(test_method):
+  """
+  Skips a test which calls the API when there are neither credentials for
+  the live API nor a cassette to replay.
+  """
+  def needs_api_runner(*args, **kwargs):
+    if not API_AVAILABLE:
+      raise SkipTest('Needs API credentials or a recorded cassette.')
+    test_method(*args, **kwargs)
+  if NOSE_ENABLED:
+    return make_decorator(test_method)(needs_api_runner)
+  else:
+    return needs_api_runner
+
+def needs_live_api(test_method):
+  """
+  Skips a test of the OAuth dance, which no cassette can replay, unless
+  there are credentials for the live API.
+  """
+  def needs_live_api_runner(*args, **kwargs):
+    if not HAS_CREDENTIALS or (CASSETTE_PATH and not RECORDING):
+      raise SkipTest('Needs API credentials and the live API.')
+    test_method(*args, **kwargs)
+  if NOSE_ENABLED:
+    return make_decorator(test_method)(needs_live_api_runner)
+  else:
+    return needs_live_api_runner
+
 def clear_posts():
   # Make sure we don't have any posts
   posts = CLIENT.posts()
@@ -93,6 +174,7 @@ def test_auth_required():
     assert True, "Great, it worked."
 
 @dumpjson
+@needs_live_api
 def test_anonymous_consumer():
   client = buzz.Client()
   client.use_anonymous_oauth_consumer()
@@ -105,6 +187,7 @@ def test_anonymous_consumer():
     "Could not build authorization URL"
 
 @dumpjson
+@needs_live_api
 def test_registered_consumer():
   client = buzz.Client()
   client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
@@ -117,6 +200,7 @@ def test_registered_consumer():
     "Could not build authorization URL"
 
 @dumpjson
+@needs_api
 def test_person_me():
   result = CLIENT.person()
   person = result.data
@@ -127,6 +211,7 @@ def test_person_me():
     "Could not obtain reference to the account's profile link."
 
 @dumpjson
+@needs_api
 def test_person_other():
   result = CLIENT.person(BUZZ_TESTING_ID)
   person = result.data
@@ -155,12 +240,14 @@ def test_person_other_without_auth():
     assert True, "Great, it worked."
 
 @dumpjson
+@needs_api
 def test_followers_me():
   result = CLIENT.followers()
   followers = result.data
   assert_list(followers)
 
 @dumpjson
+@needs_api
 def test_followers_paginates():
   client = buzz.Client()
   result = client.followers('googlebuzz')
@@ -174,6 +261,7 @@ def test_followers_paginates():
     % (buzz.DEFAULT_PAGE_SIZE, follower_count)
 
 @dumpjson
+@needs_api
 def test_following_paginates():
   client = buzz.Client()
   result = client.following('googlebuzz')
@@ -187,6 +275,7 @@ def test_following_paginates():
     " not %s" % (buzz.DEFAULT_PAGE_SIZE, following_count)
 
 @dumpjson
+@needs_api
 def test_followers_other():
   client = buzz.Client()
   result = client.followers(BUZZ_TESTING_ID)
@@ -194,12 +283,14 @@ def test_followers_other():
   assert_list(followers)
 
 @dumpjson
+@needs_api
 def test_following_me():
   result = CLIENT.following()
   following = result.data
   assert_list(following)
 
 @dumpjson
+@needs_api
 def test_following_other():
   client = buzz.Client()
   result = client.following(BUZZ_TESTING_ID)
@@ -207,6 +298,7 @@ def test_following_other():
   assert_list(following)
 
 @dumpjson
+@needs_api
 def test_follow():
   person = CLIENT.person(BUZZ_TARGET_ID).data
   person.follow()
@@ -221,6 +313,7 @@ def test_follow():
   CLIENT.unfollow(BUZZ_TARGET_ID)
 
 @dumpjson
+@needs_api
 def test_unfollow():
   person = CLIENT.person(BUZZ_TARGET_ID).data
   person.follow()
@@ -253,6 +346,7 @@ def test_unfollow_without_auth():
     assert True, "Great, it worked."
 
 @dumpjson
+@needs_api
 def test_people_search():
   client = buzz.Client()
   result = client.people_search("googlebuzzteam")
@@ -263,6 +357,7 @@ def test_people_search():
       "Could not obtain reference to the person."      
 
 @dumpjson
+@needs_api
 def test_people_search_by_topic_location():
   client = buzz.Client()
   result = client.people_search_by_topic(
@@ -277,6 +372,7 @@ def test_people_search_by_topic_location():
       "Could not obtain reference to the person."
 
 @dumpjson
+@needs_api
 def test_search_location():
   client = buzz.Client()
   result = client.search(
@@ -291,6 +387,7 @@ def test_search_location():
       "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_search_query():
   client = buzz.Client()
   result = client.search(query="google")
@@ -303,6 +400,7 @@ def test_search_query():
       break
 
 @dumpjson
+@needs_api
 def test_search_query_results_can_be_restricted():
   client = buzz.Client()
   max_results = 2
@@ -312,6 +410,7 @@ def test_search_query_results_can_be_restricted():
   assert max_results == len(posts)
 
 @dumpjson
+@needs_api
 def test_posts_me():
   result = CLIENT.posts()
   posts = result.data
@@ -322,6 +421,7 @@ def test_posts_me():
       "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_posts_other():
   client = buzz.Client()
   result = client.posts(type_id='@public', user_id=BUZZ_TESTING_ID)
@@ -333,6 +433,7 @@ def test_posts_other():
       "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_consumption_me():
   result = CLIENT.posts(type_id='@consumption')
   posts = result.data
@@ -343,6 +444,7 @@ def test_consumption_me():
       "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_consumption_other():
   client = buzz.Client()
   try:
@@ -352,6 +454,7 @@ def test_consumption_other():
     assert True, "Great, it worked."
 
 @dumpjson
+@needs_api
 def test_post():
   client = buzz.Client()
   result = client.post(post_id=BUZZ_POST_ID)
@@ -360,6 +463,7 @@ def test_post():
     "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_create_post():
   clear_posts()
   time.sleep(1.5)
@@ -369,6 +473,7 @@ def test_create_post():
     "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_create_post_with_link():
   clear_posts()
   time.sleep(1.5)
@@ -396,6 +501,7 @@ def test_create_post_with_link():
   assert post.attachments[0].type == 'article'
 
 @dumpjson
+@needs_api
 def test_create_post_with_photo():
   clear_posts()
   time.sleep(1.5)
@@ -455,6 +561,7 @@ def test_create_post_with_photo():
 #  assert post.attachments[0].type == 'video'
 
 @dumpjson
+@needs_api
 def test_create_post_with_geocode():
   clear_posts()
   time.sleep(1.5)
@@ -472,6 +579,7 @@ def test_create_post_with_geocode():
   assert str(post.geocode[1]) == '-122.0843'
 
 @dumpjson
+@needs_api
 def test_create_post_with_seven_bit_character_set():
   post = None
   try:
@@ -494,6 +602,7 @@ def test_create_post_with_seven_bit_character_set():
       None
 
 @dumpjson
+@needs_api
 def test_created_post_has_published_field():
   clear_posts()
   time.sleep(1.5)
@@ -503,6 +612,7 @@ def test_created_post_has_published_field():
     "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_update_post():
   clear_posts()
   post = create_post()
@@ -517,6 +627,7 @@ def test_update_post():
     "Could not obtain reference to the post."
 
 @dumpjson
+@needs_api
 def test_delete_post():
   create_post()
   time.sleep(1.5)
@@ -525,6 +636,7 @@ def test_delete_post():
   assert CLIENT.posts().data == []
 
 @dumpjson
+@needs_api
 def test_comments():
   client = buzz.Client()
   result = client.comments(post_id=BUZZ_POST_ID)
@@ -536,6 +648,7 @@ def test_comments():
       "Could not obtain reference to the comment."
 
 @dumpjson
+@needs_api
 def test_create_comment():
   clear_posts()
   post = create_post()
@@ -554,6 +667,7 @@ def test_create_comment():
   assert comment.content == "CLIENTTEST: This is a test comment."
 
 @dumpjson
+@needs_api
 def test_update_comment():
   clear_posts()
   post = create_post()
@@ -570,6 +684,7 @@ def test_update_comment():
   assert comment.content == "CLIENTTEST: This is updated content."
 
 @dumpjson
+@needs_api
 def test_delete_comment():
   clear_posts()
   post = create_post()
@@ -588,6 +703,7 @@ def test_delete_comment():
   assert comments == []
 
 @dumpjson
+@needs_api
 def test_related_links():
   clear_posts()
   client = buzz.Client()
@@ -599,6 +715,7 @@ def test_related_links():
     "Not enough related links for the post."
 
 @dumpjson
+@needs_api
 def test_commented_posts():
   clear_posts()
   post = create_post()
@@ -610,6 +727,7 @@ def test_commented_posts():
   assert len(CLIENT.commented_posts().data) > 0
 
 @dumpjson
+@needs_api
 def test_like_post():
   clear_posts()
   post = CLIENT.post(post_id=BUZZ_POST_ID).data
@@ -620,6 +738,7 @@ def test_like_post():
   clear_posts()
 
 @dumpjson
+@needs_api
 def test_unlike_post():
   clear_posts()
   post = CLIENT.post(post_id=BUZZ_POST_ID).data
@@ -634,12 +753,14 @@ def test_unlike_post():
   clear_posts()
 
 @dumpjson
+@needs_api
 def test_post_likers():
   post = CLIENT.post(post_id=BUZZ_POST_ID).data
   likers = post.likers().data
   assert_populated_list(likers, "Should have more than 0 likers")
 
 @dumpjson
+@needs_api
 def test_mute_post():
   clear_posts()
   post = CLIENT.post(post_id=BUZZ_POST_ID).data
@@ -647,6 +768,7 @@ def test_mute_post():
   post.mute()
 
 @dumpjson
+@needs_api
 def test_unmute_post():
   clear_posts()
   post = CLIENT.post(post_id=BUZZ_POST_ID).data
@@ -655,10 +777,628 @@ def test_unmute_post():
   post.unmute()
 
 @dumpjson
+@needs_api
 def test_share_count():
   count = CLIENT.share_count('http://www.google.com/')
   assert count > 0
 
+@dumpjson
+def test_connection_pool_waits_for_checkin():
+  pool = buzz.ConnectionPool(max_connections=1, timeout=0.1)
+  connection = pool.checkout('https', 'www.googleapis.com', 443)
+  try:
+    pool.checkout('https', 'www.googleapis.com', 443)
+    assert False, "Checkout should have timed out."
+  except buzz.RetrieveError:
+    assert True, "Great, it worked."
+  pool.checkin(connection)
+  assert pool.checkout('https', 'www.googleapis.com', 443) is connection
+
+@dumpjson
+@needs_api
+def test_client_shared_between_threads():
+  errors = []
+  def fetch_posts():
+    try:
+      assert_list(CLIENT.posts(user_id=BUZZ_TESTING_ID).data)
+    except Exception, e:
+      errors.append(e)
+  threads = [threading.Thread(target=fetch_posts) for i in range(5)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert not errors, "Threads failed: %s" % errors
+
+@dumpjson
+def test_clients_share_connection_pool():
+  assert buzz.Client().connection_pool is buzz.SHARED_CONNECTION_POOL
+  assert buzz.Client().connection_pool is CLIENT.connection_pool
+  client = buzz.Client(share_connections=False)
+  assert client.connection_pool is not buzz.SHARED_CONNECTION_POOL
+  async_client = buzz.AsyncClient(max_workers=2)
+  assert async_client.connection_pool is buzz.SHARED_CONNECTION_POOL
+  async_client.close()
+  async_client = buzz.AsyncClient(max_workers=2, share_connections=False)
+  assert async_client.connection_pool is not buzz.SHARED_CONNECTION_POOL
+  async_client.close()
+
+@dumpjson
+@needs_api
+def test_prefetching_iterator_preserves_order():
+  def first_ids(iterator, count=30):
+    ids = []
+    for post in iterator:
+      ids.append(post.id)
+      if len(ids) >= count:
+        break
+    return ids
+  plain = first_ids(CLIENT.posts(
+    user_id='googlebuzz', type_id='@public', max_results=5
+  ))
+  prefetched = first_ids(CLIENT.posts(
+    user_id='googlebuzz', type_id='@public', max_results=5
+  ).iterator(prefetch=2))
+  assert plain == prefetched, "%s != %s" % (plain, prefetched)
+
+@dumpjson
+def test_abandoned_prefetching_iterator_stops():
+  client = buzz.Client()
+  client.transport = buzz.Cassette(None)
+  uri = client.posts(user_id=BUZZ_TESTING_ID)._request.uri
+  for page in range(5):
+    next_uri = uri + '&c=%d' % (page + 1)
+    client.transport.add('GET', uri, 200, buzz.JSON_BACKEND.encode({
+      'data': {
+        'items': [{'id': 'post%d' % page, 'title': 'Post'}],
+        'links': {'next': [{'href': next_uri}]}
+      }
+    }))
+    uri = next_uri
+  iterator = client.posts(user_id=BUZZ_TESTING_ID).iterator(prefetch=1)
+  assert iterator.next().id == 'post0'
+  # Give the background thread time to fill the queue and block on it
+  time.sleep(0.2)
+  thread = iterator._prefetcher._thread
+  iterator.close()
+  thread.join(2)
+  assert not thread.isAlive(), "Prefetch thread should have stopped."
+
+@dumpjson
+@needs_api
+def test_followers_fan_out_preserves_order():
+  client = buzz.Client()
+  def first_ids(result, count=buzz.DEFAULT_PAGE_SIZE * 3):
+    ids = []
+    for person in result:
+      ids.append(person.id)
+      if len(ids) >= count:
+        break
+    return ids
+  sequential = first_ids(client.followers('googlebuzz', concurrency=1))
+  concurrent = first_ids(client.followers('googlebuzz', concurrency=4))
+  assert sequential == concurrent, "%s != %s" % (sequential, concurrent)
+
+@dumpjson
+def test_worker_pool_reports_errors():
+  pool = buzz.WorkerPool(max_workers=2)
+  future = pool.submit(int, 'not a number')
+  assert isinstance(future.exception(), ValueError)
+  assert pool.submit(int, '42').result() == 42
+  pool.shutdown()
+
+@dumpjson
+@needs_api
+def test_async_client():
+  async_client = buzz.AsyncClient(CLIENT)
+  futures = [
+    async_client.person(BUZZ_TESTING_ID),
+    async_client.posts(user_id=BUZZ_TESTING_ID, max_results=2)
+  ]
+  person = futures[0].result().data
+  assert person.id == BUZZ_TESTING_ID
+  result = futures[1].result()
+  assert_list(result.data)
+  if result.next_uri:
+    assert async_client.next_page(result).result() is result
+  async_client.close()
+
+@dumpjson
+def test_retry_policy():
+  policy = buzz.RetryPolicy(max_retries=2, backoff_base=1.0, budget_max=2.0)
+  assert policy.retry_delay('GET', 0, status=404) is None
+  assert policy.retry_delay('POST', 0, status=503) is None
+  assert 0 <= policy.retry_delay('GET', 1, status=503) <= 2.0
+  assert policy.retry_delay('GET', 0, status=503, retry_after='7') == 7.0
+  # The budget is spent
+  assert policy.retry_delay('GET', 0, status=503) is None
+  for i in range(5):
+    policy.record_request()
+  assert policy.retry_delay('GET', 0) is not None
+  assert policy.retry_delay('GET', 2, status=503) is None
+
+@dumpjson
+def test_rate_limiter_paces_requests():
+  rate_limiter = buzz.RateLimiter(token_rate=20, token_burst=1)
+  start = time.time()
+  for i in range(5):
+    rate_limiter.acquire('consumer', 'token')
+  assert time.time() - start >= 0.15
+  # Other access tokens have buckets of their own
+  assert rate_limiter.acquire('consumer', 'other token') == 0
+  stats = rate_limiter.stats()
+  assert stats['requests'] == 6
+  assert stats['delayed_requests'] == 4
+  assert stats['max_wait'] > 0
+
+@dumpjson
+def test_single_flight_shares_calls():
+  single_flight = buzz.SingleFlight()
+  calls = []
+  values = []
+  def slow_call():
+    calls.append(1)
+    time.sleep(0.2)
+    return object()
+  def caller():
+    values.append(single_flight.do('key', slow_call))
+  threads = [threading.Thread(target=caller) for i in range(5)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert len(calls) == 1
+  assert len(set([id(value) for value in values])) == 1
+
+@dumpjson
+def test_response_cache():
+  cache = buzz.ResponseCache(max_entries=2, ttls={'person': 0})
+  cache.put('a', {'a': 1}, 10)
+  cache.put('b', {'b': 1}, 10)
+  assert cache.get('a') == {'a': 1}
+  cache.put('c', {'c': 1}, 10)
+  # 'b' was the least recently used
+  assert cache.get('b') is None
+  cache.put('d', {'d': 1}, 10, endpoint='person')
+  assert cache.get('d') is None
+  stats = cache.stats()
+  assert stats['hits'] == 1
+  assert stats['misses'] == 2
+  assert stats['evictions'] == 1
+  assert stats['entries'] == 2
+
+@dumpjson
+@needs_api
+def test_cached_person():
+  client = buzz.Client()
+  client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
+  client.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
+  client.response_cache = buzz.ResponseCache()
+  first = client.person(BUZZ_TESTING_ID).data
+  second = client.person(BUZZ_TESTING_ID).data
+  assert first.id == second.id
+  assert client.response_cache.stats()['hits'] == 1
+
+@dumpjson
+@needs_api
+def test_reload_revalidates():
+  result = CLIENT.person(BUZZ_TESTING_ID)
+  person = result.data
+  result.reload()
+  assert result.data.id == person.id
+  if result._response.status == 304:
+    assert result.data is person, "Unchanged page should not be re-parsed."
+
+@dumpjson
+@needs_api
+def test_compressed_and_uncompressed_responses_match():
+  client = buzz.Client()
+  compressed = client.posts(user_id='googlebuzz', type_id='@public').data
+  client.compress_responses = False
+  uncompressed = client.posts(user_id='googlebuzz', type_id='@public').data
+  assert [post.id for post in compressed] == \
+    [post.id for post in uncompressed]
+
+@dumpjson
+@needs_api
+def test_streamed_iterator_preserves_order():
+  def first_ids(iterator, count=30):
+    ids = []
+    for post in iterator:
+      ids.append(post.id)
+      if len(ids) >= count:
+        break
+    return ids
+  plain = first_ids(CLIENT.posts(
+    user_id='googlebuzz', type_id='@public', max_results=5
+  ))
+  streamed = first_ids(CLIENT.posts(
+    user_id='googlebuzz', type_id='@public', max_results=5
+  ).iterator(stream=True))
+  assert plain == streamed, "%s != %s" % (plain, streamed)
+
+@dumpjson
+@needs_api
+def test_raw_iterator_matches_models():
+  posts = CLIENT.posts(
+    user_id='googlebuzz', type_id='@public', max_results=5
+  ).data
+  raw = CLIENT.posts(
+    user_id='googlebuzz', type_id='@public', max_results=5
+  ).iterator(raw=True)
+  for post in posts:
+    post_json = raw.next()
+    assert isinstance(post_json, dict)
+    assert post_json['id'] == post.id
+  # The result itself still builds models
+  result = buzz.Result(CLIENT, 'GET', buzz.API_PREFIX)
+  result._response = buzz._BufferedResponse(200, 'OK')
+  result._json = {'data': {'items': [{'id': '1'}]}}
+  assert isinstance(result.iterator(raw=True).next(), dict)
+  assert isinstance(result.data[0], buzz.Post)
+
+@dumpjson
+def test_post_fields_decoded_lazily():
+  post = buzz.Post({
+    'id': 'tag:google.com,2010:buzz:z12345',
+    'title': 'Lazy post',
+    'actor': {'id': BUZZ_TESTING_ID, 'name': 'Tester'},
+    'links': {'alternate': [{'href': 'http://www.google.com/buzz/1'}]}
+  })
+  assert not hasattr(post, '_lazy_actor')
+  assert post.actor.id == BUZZ_TESTING_ID
+  assert post.actor is post.actor
+  assert post.uri == 'http://www.google.com/buzz/1'
+  assert buzz.Post(post.json, content='Explicit').content == 'Explicit'
+
+@dumpjson
+@needs_api
+def test_models_release_json():
+  client = buzz.Client()
+  client.retain_json = False
+  posts = client.posts(user_id='googlebuzz', type_id='@public').data
+  assert_list(posts)
+  for post in posts:
+    assert post.json is None
+    assert post.actor.json is None
+    assert post.id
+    assert not hasattr(post, '__dict__')
+
+@dumpjson
+@needs_api
+def test_people_shared_between_posts():
+  client = buzz.Client()
+  actor_json = {'id': BUZZ_TESTING_ID, 'name': 'Tester'}
+  posts = [
+    buzz.Post({'id': 'post%d' % i, 'title': 'Post', 'actor': actor_json},
+      client=client)
+    for i in range(3)
+  ]
+  assert posts[0].actor is posts[1].actor is posts[2].actor
+  # Fetching the full profile upgrades the shared object in place
+  person = CLIENT.person(BUZZ_TESTING_ID).data
+  upgraded = CLIENT._shared_person(person.json, upgrade=True)
+  assert upgraded is person
+
+@dumpjson
+def test_richer_actor_merged_into_shared_person():
+  client = buzz.Client()
+  sparse = client._shared_person({'id': BUZZ_TESTING_ID, 'name': 'Tester'})
+  assert sparse.uri is None
+  richer = client._shared_person({
+    'id': BUZZ_TESTING_ID,
+    'profileUrl': 'http://www.google.com/profiles/tester'
+  })
+  assert richer is sparse
+  assert richer.name == 'Tester'
+  assert richer.uri == 'http://www.google.com/profiles/tester'
+
+@dumpjson
+def test_projected_profile_leaves_shared_person():
+  client = buzz.Client()
+  client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
+  client.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
+  shared = client._shared_person({
+    'id': BUZZ_TESTING_ID, 'displayName': 'Tester',
+    'profileUrl': 'http://www.google.com/profiles/tester'
+  })
+  result = client.person(BUZZ_TESTING_ID, fields='data(id)')
+  projected = result._decode_page({'data': {'id': BUZZ_TESTING_ID}})
+  assert projected is not shared
+  assert shared.name == 'Tester'
+  assert shared.uri == 'http://www.google.com/profiles/tester'
+
+@dumpjson
+def test_projected_actor_leaves_shared_person():
+  client = buzz.Client()
+  projected = client.posts(
+    user_id=BUZZ_TESTING_ID, fields='data(items(actor/id))'
+  )
+  posts = projected._decode_page({'data': {'items': [
+    {'actor': {'id': BUZZ_TESTING_ID}}
+  ]}})
+  assert posts[0].actor.id == BUZZ_TESTING_ID
+  full = client.posts(user_id=BUZZ_TESTING_ID)
+  posts = full._decode_page({'data': {'items': [{
+    'id': 'post1', 'title': 'Post',
+    'actor': {
+      'id': BUZZ_TESTING_ID, 'name': 'Tester',
+      'profileUrl': 'http://www.google.com/profiles/tester'
+    }
+  }]}})
+  assert posts[0].actor.name == 'Tester'
+  assert posts[0].actor.uri == 'http://www.google.com/profiles/tester'
+
+@dumpjson
+def test_result_decoders_registry():
+  class Tag:
+    def __init__(self, json):
+      self.term = json['term']
+  def decode_tag(json, result):
+    return Tag(json)
+  buzz.RESULT_DECODERS[Tag] = decode_tag
+  try:
+    result = buzz.Result(CLIENT, 'GET', buzz.API_PREFIX, result_type=Tag)
+    tags = result._decode_page(
+      {'data': {'items': [{'term': 'buzz'}, {'term': 'python'}]}}
+    )
+    assert [tag.term for tag in tags] == ['buzz', 'python']
+  finally:
+    del buzz.RESULT_DECODERS[Tag]
+
+@dumpjson
+def test_json_backend():
+  assert buzz.JSON_BACKEND.name
+  # Illegal control characters don't break decoding
+  json = buzz.JSON_BACKEND.decode('{"data": {"content": "a\x01b"}}')
+  assert json['data']['content'] == u'a\x01b'
+  backend = buzz.JSONBackend('simplejson', buzz.simplejson)
+  assert backend.decode(buzz.JSON_BACKEND.encode(json)) == json
+
+@dumpjson
+def test_oauth_signer_matches_oauth_library():
+  client = buzz.Client()
+  client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
+  client.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
+  uri = buzz.API_PREFIX + \
+    '/activities/search?q&lon=1123&lat=456&max-results=2&c=2'
+  oauth_request = client.build_oauth_request('GET', uri)
+  oauth_request.set_parameter('oauth_nonce', '12345678')
+  oauth_request.set_parameter('oauth_timestamp', 1286000000)
+  oauth_request.sign_request(
+    client._oauth_signature_method_hmac_sha1,
+    client.oauth_consumer,
+    client.oauth_access_token
+  )
+  parameters = dict(client.oauth_signer.sign(
+    'GET', uri, nonce='12345678', timestamp=1286000000
+  ))
+  assert parameters['oauth_signature'] == \
+    buzz.oauth.escape(oauth_request.get_parameter('oauth_signature'))
+  assert client.oauth_signer is client.oauth_signer
+
+@dumpjson
+def test_api_requests_are_comparable():
+  request = buzz._APIRequest(
+    'GET', '/activities/%s/@self', ('googlebuzz',),
+    params=[('alt', 'json'), ('q', None), ('max-results', 20)]
+  )
+  assert request.uri == buzz.API_PREFIX + \
+    '/activities/googlebuzz/@self?alt=json&max-results=20'
+  same = buzz._APIRequest.from_uri('GET', buzz.API_PREFIX + \
+    '/activities/googlebuzz/@self?max-results=20&alt=json')
+  assert request == same
+  assert hash(request) == hash(same)
+  assert request != buzz._APIRequest.from_uri('DELETE', request.uri)
+  next_page = request.with_param('c', 20)
+  assert next_page != request
+  assert next_page.parameters['c'] == '20'
+  result = CLIENT.posts(user_id='googlebuzz')
+  assert result._request == request.with_param('prettyPrint', 'false')
+
+@dumpjson
+@needs_api
+def test_map_fetch_keeps_order_and_errors():
+  user_ids = [BUZZ_TESTING_ID, 'no-such-user-exists', BUZZ_TARGET_ID]
+  futures = CLIENT.map_fetch(CLIENT.person, user_ids)
+  assert [future.done() for future in futures] == [True, True, True]
+  assert futures[0].result().data.id == BUZZ_TESTING_ID
+  assert isinstance(futures[1].exception(), buzz.RetrieveError)
+  assert futures[2].result().data.id == BUZZ_TARGET_ID
+
+@dumpjson
+@needs_api
+def test_batch():
+  batch = CLIENT.batch()
+  assert batch.person(BUZZ_TESTING_ID) == 0
+  assert batch.posts(user_id=BUZZ_TESTING_ID, max_results=2) == 1
+  futures = batch.execute()
+  assert len(batch) == 0
+  assert futures[0].result().data.id == BUZZ_TESTING_ID
+  assert_list(futures[1].result().data)
+
+class BatchStandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers person lookups in a multipart batch like the API would."""
+  def log_message(self, *args):
+    pass
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    boundary = cgi.parse_header(self.headers['Content-Type'])[1]['boundary']
+    parts = []
+    for part in body.split('--' + boundary)[1:-1]:
+      head, request = part.lstrip('\r\n').split('\r\n\r\n', 1)
+      content_id = re.search('Content-ID: <(.*)>', head).group(1)
+      path = request.split(' ')[1].split('?')[0]
+      user_id = path.split('/')[-2]
+      if user_id == 'missing':
+        status = '404 Not Found'
+        json = '{"error": {"message": "Not found"}}'
+      else:
+        status = '200 OK'
+        json = '{"data": {"id": "%s", "displayName": "%s"}}' % (
+          user_id, user_id.title()
+        )
+      parts.append(
+        '--response_boundary\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-%s>\r\n\r\n'
+        'HTTP/1.1 %s\r\n'
+        'Content-Type: application/json\r\n'
+        'Content-Length: %d\r\n\r\n%s\r\n' % (
+          content_id, status, len(json), json
+        )
+      )
+    response = ''.join(parts) + '--response_boundary--'
+    self.send_response(200)
+    self.send_header(
+      'Content-Type', 'multipart/mixed; boundary=response_boundary'
+    )
+    self.send_header('Content-Length', str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+
+@dumpjson
+def test_multipart_batch():
+  server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), BatchStandIn)
+  thread = threading.Thread(target=server.handle_request)
+  thread.start()
+  # The stand-in is on a new port every time, so it's never recorded
+  client = buzz.Client()
+  client.transport = None
+  client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
+  client.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
+  batch = buzz.Batch(
+    client, multipart=True,
+    batch_uri='http://127.0.0.1:%d/batch' % server.server_address[1]
+  )
+  batch.person('alice')
+  batch.person('missing')
+  batch.person('bob')
+  futures = batch.execute()
+  thread.join()
+  server.server_close()
+  assert futures[0].result().data.id == 'alice'
+  assert isinstance(futures[1].exception(), buzz.RetrieveError)
+  assert futures[2].result().data.name == 'Bob'
+
+@dumpjson
+def test_multipart_batch_replays():
+  server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), BatchStandIn)
+  thread = threading.Thread(target=server.handle_request)
+  thread.start()
+  batch_uri = 'http://127.0.0.1:%d/batch' % server.server_address[1]
+  path = tempfile.mktemp(suffix='.json')
+  client = buzz.Client()
+  client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
+  client.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
+  try:
+    client.api_key = 'SECRETKEY'
+    client.transport = buzz.Cassette(path, record=True)
+    batch = buzz.Batch(client, multipart=True, batch_uri=batch_uri)
+    batch.person('alice')
+    batch.person('bob')
+    batch.execute()
+    thread.join()
+    server.server_close()
+    client.transport.save()
+    assert 'SECRETKEY' not in open(path).read()
+    # The same batch has the same body, so it's replayed without the server,
+    # whatever the API key
+    client.api_key = 'OTHERKEY'
+    client.transport = buzz.Cassette(path)
+    batch = buzz.Batch(client, multipart=True, batch_uri=batch_uri)
+    batch.person('alice')
+    batch.person('bob')
+    futures = batch.execute()
+    assert futures[0].result().data.id == 'alice'
+    assert futures[1].result().data.name == 'Bob'
+  finally:
+    if os.path.exists(path):
+      os.remove(path)
+
+@dumpjson
+@needs_api
+def test_field_projection():
+  result = CLIENT.posts(
+    user_id=BUZZ_TESTING_ID, fields='data(items(published,actor/id),links)'
+  )
+  assert result._request.parameters['fields'] == \
+    'data(items(published,actor/id),links)'
+  assert result._request.parameters['prettyPrint'] == 'false'
+  posts = result._decode_page({'data': {'items': [
+    {'published': '2010-06-01T12:00:00.000Z', 'actor': {'id': '123'}}
+  ]}})
+  assert posts[0].id is None
+  assert posts[0].title is None
+  assert posts[0].actor.id == '123'
+  for post in result.data:
+    assert post.published
+
+@dumpjson
+@needs_api
+def test_item_filter():
+  seen = []
+  def has_geocode(post_json):
+    seen.append(post_json)
+    return post_json.get('geocode')
+  result = buzz.Result(
+    CLIENT, 'GET', buzz.API_PREFIX, item_filter=has_geocode
+  )
+  posts = result._decode_page({'data': {'items': [
+    {'id': '1'}, {'id': '2', 'geocode': '37.4 -122.1'}, {'id': '3'}
+  ]}})
+  assert [post.id for post in posts] == ['2']
+  assert len(seen) == 3
+  # Filtering an iterator leaves the result it came from unfiltered
+  result = buzz.Result(CLIENT, 'GET', buzz.API_PREFIX)
+  result._response = buzz._BufferedResponse(200, 'OK')
+  result._json = {'data': {'items': [
+    {'id': '1'}, {'id': '2', 'geocode': '37.4 -122.1'}
+  ]}}
+  assert [post.id for post in result.iterator(item_filter=has_geocode)] == \
+    ['2']
+  assert [post.id for post in result.data] == ['1', '2']
+  assert [post.id for post in result] == ['1', '2']
+  results = CLIENT.search(
+    latitude=GOOGLEPLEX_LATITUDE, longitude=GOOGLEPLEX_LONGITUDE, radius=1000
+  )
+  for count, post in enumerate(results.iterator(item_filter=has_geocode)):
+    assert post.geocode
+    if count > buzz.DEFAULT_PAGE_SIZE:
+      break
+
+@dumpjson
+def test_cassette_replays_responses():
+  uri = buzz.API_PREFIX + '/people/%s/@self' % BUZZ_TESTING_ID
+  cassette = buzz.Cassette(None, latency=0.1)
+  cassette.add(
+    'GET', uri + '?alt=json&prettyPrint=false', 200,
+    '{"data": {"id": "%s", "displayName": "Replayed"}}' % BUZZ_TESTING_ID
+  )
+  client = buzz.Client()
+  client.transport = cassette
+  start = time.time()
+  # The order of the query parameters doesn't matter
+  response = client.fetch_api_response(
+    'GET', uri + '?prettyPrint=false&alt=json'
+  )
+  assert time.time() - start >= 0.1
+  assert response.status == 200
+  client.build_oauth_consumer(OAUTH_CONSUMER_KEY, OAUTH_CONSUMER_SECRET)
+  client.build_oauth_access_token(OAUTH_TOKEN_KEY, OAUTH_TOKEN_SECRET)
+  person = client.person(BUZZ_TESTING_ID).data
+  assert person.name == 'Replayed'
+  try:
+    client.person('someone-else').data
+    assert False, 'Only recorded requests should be replayed.'
+  except buzz.RetrieveError:
+    pass
+  # The API key is neither recorded nor needed to replay
+  cassette.add('GET', uri + '?key=SECRETKEY&alt=json', 200, '{}')
+  assert 'SECRETKEY' not in cassette._interactions[-1]['request']['uri']
+  assert client.fetch_api_response('GET', uri + '?alt=json').status == 200
+
 if __name__ == '__main__':
   if NOSE_ENABLED:
     config = nose.config.Config(includeExe=True, verbosity=3)